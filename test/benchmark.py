@@ -0,0 +1,284 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Benchmarks for the test harness itself (not the design), run with:
+#   make MODULE=benchmark
+#
+# Each benchmark reports its wall time, simulated clock cycles, cycles per second
+# and wake ups of the benchmarked coroutine per cycle, into BENCHMARK_JSON.
+# If BENCHMARK_BASELINE is the JSON of an earlier run, a benchmark fails when
+# it is slower than in the baseline by more than BENCHMARK_THRESHOLD (a fraction).
+# The benchmarks of the pure Python helpers (e.g. ws2812) do not simulate anything,
+# they report their own rate instead, and are run here to track regressions the same way.
+
+import json
+import os
+import random
+import time
+
+import cocotb
+from cocotb.utils import get_sim_time
+
+import numpy as np
+
+from pulse_model import PIN_CARRIER, PIN_PULSE
+from test import Device, TQV_BACKEND, CLOCK_PERIOD_PS, MAX_PROGRAM_1BPE_LEN, MAX_PROGRAM_2BPE_LEN, MAX_PROGRAM_LOOP_LEN
+import timing_index
+import waveform_compiler
+import ws2812
+
+WRITE_BENCHMARK_TRANSACTIONS = 200
+UPLOAD_BENCHMARK_REPEATS = 20
+WS2812_BENCHMARK_PIXELS = (100, 1000, 10000)
+WS2812_BENCHMARK_SECONDS = 0.5
+WAVEFORM_BENCHMARK_SECONDS = 0.5
+TIMING_INDEX_BENCHMARK_QUERIES = 10000
+
+BENCHMARK_JSON = os.environ.get("BENCHMARK_JSON", "benchmark.json")
+BENCHMARK_BASELINE = os.environ.get("BENCHMARK_BASELINE")
+BENCHMARK_THRESHOLD = float(os.environ.get("BENCHMARK_THRESHOLD", "0.25"))
+
+# The results of this run, written to BENCHMARK_JSON after each benchmark
+results = {"backend": TQV_BACKEND, "sim": os.environ.get("SIM", "icarus"), "benchmarks": {}}
+
+baseline = None
+if BENCHMARK_BASELINE:
+    with open(BENCHMARK_BASELINE) as f:
+        baseline = json.load(f)
+
+class _WakeupCounter:
+    """
+    Awaits a coroutine, counting the triggers it awaits, i.e. the times the simulator wakes it up.
+    Coroutines it starts with cocotb.start_soon() are not counted.
+    """
+    def __init__(self, coro):
+        self.coro = coro
+        self.wakeups = 0
+
+    def __await__(self):
+        inner = self.coro.__await__()
+        send, value = inner.send, None
+        while True:
+            try:
+                trigger = send(value)
+            except StopIteration as e:
+                return e.value
+            self.wakeups += 1
+            try:
+                value = yield trigger
+                send = inner.send
+            except BaseException as e:
+                send, value = inner.throw, e
+
+async def _measure(device: Device, name: str, run) -> dict:
+    """
+    Measure an awaitable, record it in BENCHMARK_JSON and compare it against BENCHMARK_BASELINE.
+    Its wake ups are the triggers it awaits, and those of the waveform checkers of the device.
+
+    Args:
+        device (Device): The device the coroutine drives
+        name (str): The name of the benchmark
+        run: The coroutine to measure
+
+    Returns:
+        dict: The metrics of the benchmark
+    """
+    dut = device.dut
+    counter = _WakeupCounter(run)
+    checker_awaits = device.counters["checker_awaits"]
+    start_sim_time = get_sim_time("ps")
+    start_time = time.perf_counter()
+    try:
+        await counter
+    finally:
+        wall_time = time.perf_counter() - start_time
+
+    cycles = int(get_sim_time("ps") - start_sim_time) // CLOCK_PERIOD_PS
+    metrics = {
+        "wall_time": wall_time,
+        "sim_cycles": cycles,
+        "cycles_per_second": cycles / wall_time,
+        "wakeups_per_cycle": (counter.wakeups + device.counters["checker_awaits"] - checker_awaits) / max(cycles, 1),
+    }
+    dut._log.info(f'{name}: {wall_time:.3f} s, {cycles} cycles, {metrics["cycles_per_second"]:.0f} cycles/s, '
+                  f'{metrics["wakeups_per_cycle"]:.2f} wake ups/cycle')
+
+    _record(dut, name, metrics, {"cycles_per_second": True, "wakeups_per_cycle": False})
+    return metrics
+
+# Records the metrics of a benchmark in BENCHMARK_JSON, and checks the given metrics against BENCHMARK_BASELINE if any,
+# checked maps the name of each metric to whether higher is better
+def _record(dut, name: str, metrics: dict, checked: dict[str, bool]):
+    results["benchmarks"][name] = metrics
+    with open(BENCHMARK_JSON, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if not BENCHMARK_BASELINE:
+        return
+    if baseline["backend"] != TQV_BACKEND or name not in baseline["benchmarks"]:
+        dut._log.warning(f'{name} is not in the baseline for TQV_BACKEND={TQV_BACKEND}')
+        return
+    for metric, higher_is_better in checked.items():
+        _check(name, metric, higher_is_better)
+
+# Fails if a metric of a benchmark is worse than in BENCHMARK_BASELINE by more than BENCHMARK_THRESHOLD
+def _check(name: str, metric: str, higher_is_better: bool):
+    value = results["benchmarks"][name][metric]
+    expected = baseline["benchmarks"][name][metric]
+    if higher_is_better:
+        assert value >= expected * (1 - BENCHMARK_THRESHOLD), f'{name} regressed: {value:.4g} {metric}, baseline {expected:.4g}'
+    else:
+        assert value <= expected * (1 + BENCHMARK_THRESHOLD), f'{name} regressed: {value:.4g} {metric}, baseline {expected:.4g}'
+
+# A 32 bit register write through TQV_BACKEND
+@cocotb.test()
+async def write32_benchmark(dut):
+    device = Device(dut)
+    await device.init()
+
+    random.seed(1234)
+    values = [random.getrandbits(32) for _ in range(WRITE_BENCHMARK_TRANSACTIONS)]
+
+    async def run():
+        for value in values:
+            await device.tqv.write_word_reg(4, value)
+
+    await _measure(device, "write32", run())
+
+# Uploading the configuration and a full 2bpe program
+@cocotb.test()
+async def upload_2bpe_benchmark(dut):
+    device = Device(dut)
+    await device.init()
+
+    random.seed(1234)
+    program = [(random.randint(0, 1), random.randint(0, 1)) for _ in range(MAX_PROGRAM_2BPE_LEN)]
+    device.config_use_2bpe = 1
+    device.config_program_end_index = (len(program) - 1) * 2
+
+    async def run():
+        for _ in range(UPLOAD_BENCHMARK_REPEATS):
+            await device.write_program_2bpe(program)
+
+    await _measure(device, "upload_2bpe", run())
+
+# Transmitting and checking a full 1bpe program, with the shortest symbols
+@cocotb.test()
+async def run_1bpe_benchmark(dut):
+    device = Device(dut)
+    await device.init()
+
+    random.seed(1234)
+    program = [random.randint(0, 1) for _ in range(MAX_PROGRAM_1BPE_LEN)]
+    device.config_program_end_index = len(program) - 1
+    device.config_main_prescaler = 0
+    # A low bit is [(0, 1), (0, 0)] and a high bit [(0, 1), (1, 0)], so that the bits show on the output
+    device.config_low_symbol_0 = 0b10
+    device.config_low_symbol_1 = 0b00
+    device.config_high_symbol_0 = 0b10
+    device.config_high_symbol_1 = 0b01
+    await device.write_program_1bpe(program)
+
+    await _measure(device, "run_1bpe", device.test_expected_waveform_1bpe(program))
+
+# Transmitting and checking a program looped the maximum number of times
+@cocotb.test()
+async def max_loop_benchmark(dut):
+    device = Device(dut)
+    await device.init()
+
+    program = [(0, 1), (0, 0)]
+    device.config_use_2bpe = 1
+    device.config_program_end_index = (len(program) - 1) * 2
+    device.config_main_low_duration_b = 1
+    device.config_main_low_duration_a = 2
+    device.config_main_high_duration_b = 3
+    device.config_main_high_duration_a = 4
+    device.config_program_loop_count = MAX_PROGRAM_LOOP_LEN - 1
+    await device.write_program_2bpe(program)
+
+    await _measure(device, "max_loop", device.test_expected_waveform_2bpe(program))
+
+# Transmitting and checking a program on a carrier
+@cocotb.test()
+async def carrier_benchmark(dut):
+    device = Device(dut)
+    await device.init()
+
+    random.seed(1234)
+    program = [(random.randint(0, 1), random.randint(0, 1)) for _ in range(32)]
+    device.config_use_2bpe = 1
+    device.config_carrier_en = 1
+    device.config_carrier_duration = 5
+    device.config_program_end_index = (len(program) - 1) * 2
+    device.config_main_low_duration_a = 10
+    device.config_main_low_duration_b = 23
+    device.config_main_high_duration_a = 17
+    device.config_main_high_duration_b = 40
+    device.config_main_prescaler = 1
+    await device.write_program_2bpe(program)
+
+    await _measure(device, "carrier", device.test_expected_waveform_2bpe(program, pins=(PIN_CARRIER, PIN_PULSE)))
+
+# Encoding WS2812B frames into program pages with a gamma LUT, in frames per second
+@cocotb.test()
+async def ws2812_pipeline_benchmark(dut):
+    rng = np.random.default_rng(1234)
+    lut = ws2812.gamma_lut()
+    for num_pixels in WS2812_BENCHMARK_PIXELS:
+        pixels = rng.integers(0, 256, (num_pixels, 3), dtype=np.uint8)
+        frames = 0
+        start_time = time.perf_counter()
+        while time.perf_counter() - start_time < WS2812_BENCHMARK_SECONDS:
+            ws2812.encode_frame(pixels, lut)
+            frames += 1
+        wall_time = time.perf_counter() - start_time
+
+        name = f"ws2812_pipeline_{num_pixels}"
+        metrics = {"wall_time": wall_time, "frames_per_second": frames / wall_time}
+        dut._log.info(f'{name}: {metrics["frames_per_second"]:.0f} frames/s, {metrics["frames_per_second"] * num_pixels / 1e6:.1f} Mpixels/s')
+        _record(dut, name, metrics, {"frames_per_second": True})
+
+# Compiling waveforms into programs, in milliseconds per waveform: 256 runs of 2 shapes (1bpe),
+# and 96 runs of 3 durations per level, where runs are split into several symbols (2bpe)
+@cocotb.test()
+async def waveform_compiler_benchmark(dut):
+    rng = np.random.default_rng(1234)
+    waveforms = {
+        "1bpe": [run for bit in rng.integers(0, 2, 128).tolist() for run in (((1, 800), (0, 450)) if bit else ((1, 400), (0, 850)))],
+        "2bpe": [(index & 1, (300, 700, 1500)[duration]) for index, duration in enumerate(rng.integers(0, 3, 96).tolist())],
+    }
+    for mode, waveform in waveforms.items():
+        waveform_compiler.compile_waveform(waveform)
+        compiles = 0
+        start_time = time.perf_counter()
+        while time.perf_counter() - start_time < WAVEFORM_BENCHMARK_SECONDS:
+            waveform_compiler.compile_waveform(waveform)
+            compiles += 1
+        wall_time = time.perf_counter() - start_time
+
+        name = f"waveform_compiler_{mode}"
+        metrics = {"wall_time": wall_time, "milliseconds_per_waveform": wall_time * 1e3 / compiles}
+        dut._log.info(f'{name}: {metrics["milliseconds_per_waveform"]:.2f} ms per waveform of {len(waveform)} runs')
+        _record(dut, name, metrics, {"milliseconds_per_waveform": False})
+
+# Looking up durations and carriers in the timing index, in microseconds per query
+@cocotb.test()
+async def timing_index_benchmark(dut):
+    rng = np.random.default_rng(1234)
+    targets = rng.uniform(2, 1 << 20, TIMING_INDEX_BENCHMARK_QUERIES).tolist()
+    queries = {
+        "duration": lambda target: timing_index.nearest_duration(target),
+        "shared_prescaler": lambda target: timing_index.nearest_durations([target, target * 0.3, target * 0.1]),
+        "carrier": lambda target: timing_index.nearest_carrier(target, timing_index.CLOCK_64MHZ),
+    }
+    for query_name, query in queries.items():
+        start_time = time.perf_counter()
+        for target in targets:
+            query(target)
+        wall_time = time.perf_counter() - start_time
+
+        name = f"timing_index_{query_name}"
+        metrics = {"wall_time": wall_time, "microseconds_per_query": wall_time * 1e6 / len(targets)}
+        dut._log.info(f'{name}: {metrics["microseconds_per_query"]:.2f} us per query')
+        _record(dut, name, metrics, {"microseconds_per_query": False})
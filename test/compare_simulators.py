@@ -0,0 +1,66 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Runs the cocotb tests on several simulators and compares the wall time of each test,
+# to choose the simulator of a job.
+#
+# Usage (from the test directory, make variables are passed through):
+#   python compare_simulators.py
+#   python compare_simulators.py --sims icarus,verilator TQV_BACKEND=spi
+
+import argparse
+import os
+import sys
+import time
+
+from run_sharded import TEST_DIR, collect_tests, make, read_history
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the wall time of each test on several simulators.")
+    parser.add_argument("--sims", default="icarus,verilator", help="comma separated simulators to compare, the first one is the baseline (default: icarus,verilator)")
+    parser.add_argument("--module", default="test", help="Python test module (default: test)")
+    parser.add_argument("--no-run", action="store_true", help="only compare the results_<sim>.xml of a previous run")
+    parser.add_argument("make_args", nargs="*", help="make variables, e.g. TQV_BACKEND=spi")
+    args = parser.parse_args()
+    args.sims = args.sims.split(",")
+
+    compile_times = {}
+    run_times = {}
+    for sim in [] if args.no_run else args.sims:
+        make_args = [f"SIM={sim}", f"MODULE={args.module}", f"COCOTB_RESULTS_FILE=results_{sim}.xml", *args.make_args]
+        # Compile separately, so that the compile time is not counted in the first test.
+        # A model that is already cached takes no time here.
+        start = time.monotonic()
+        if make(["compile", *make_args]).returncode != 0:
+            sys.exit(f"Compilation failed with {sim}")
+        compile_times[sim] = time.monotonic() - start
+
+        start = time.monotonic()
+        make(make_args)
+        run_times[sim] = time.monotonic() - start
+
+    times = {sim: read_history(os.path.join(TEST_DIR, f"results_{sim}.xml")) for sim in args.sims}
+    baseline = args.sims[0]
+
+    header = f'{"test":<32}' + "".join(f"{sim:>12}" for sim in args.sims) + "".join(f"{sim + '/' + baseline:>22}" for sim in args.sims[1:])
+    print(header)
+    print("-" * len(header))
+    for test in collect_tests(args.module):
+        line = f"{test.name:<32}"
+        for sim in args.sims:
+            line += f"{times[sim][test.name]:>11.2f}s" if test.name in times[sim] else f'{"-":>12}'
+        for sim in args.sims[1:]:
+            if test.name in times[sim] and times[baseline].get(test.name):
+                line += f"{times[sim][test.name] / times[baseline][test.name]:>22.2f}"
+            else:
+                line += f'{"-":>22}'
+        print(line)
+
+    print("-" * len(header))
+    print(f'{"total of the tests":<32}' + "".join(f"{sum(times[sim].values()):>11.2f}s" for sim in args.sims))
+    if compile_times:
+        print(f'{"compile":<32}' + "".join(f"{compile_times[sim]:>11.2f}s" for sim in args.sims))
+        print(f'{"make (wall time)":<32}' + "".join(f"{run_times[sim]:>11.2f}s" for sim in args.sims))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Compiles infrared remote control commands (NEC, extended NEC, RC5, Sony SIRC)
+# into the register image and 2bpe program of the peripheral, like the NEC example in docs/info.md.
+#
+# Each protocol is described by the durations of its 4 symbols and of its leader in microseconds,
+# the prescalers and durations for a clock frequency are computed once and cached,
+# as are the compiled commands.
+
+from functools import lru_cache
+from typing import Callable, NamedTuple
+
+import program_image
+from register_image import RegisterImage
+from timing_index import MAX_CARRIER_DURATION, MAX_DURATION
+import timing_index
+
+# The relative error allowed on each duration, IR receivers accept much more
+MAX_ERROR = 0.05
+MAX_SYMBOLS = program_image.PROGRAM_BITS // 2
+MAX_REPEAT = 255 # program_loop_count
+
+# The 2bpe symbols, transmit_level << 1 | duration_selector
+LOW_A = 0b00
+LOW_B = 0b01
+HIGH_A = 0b10
+HIGH_B = 0b11
+
+class Protocol(NamedTuple):
+    carrier_hz: int
+    # Start to start, the end of each frame is padded with LOW_B then LOW_A up to it
+    frame_period_us: float
+    # The durations of LOW_A, LOW_B, HIGH_A and HIGH_B, None if unused.
+    # If LOW_B is unused, it is made as long as possible to pad the frames with few symbols
+    main_us: tuple[float, float, float, float]
+    # The durations of the leader, for duration selector 0 and 1 in the elements of auxillary_mask
+    auxillary_us: tuple[float, float]
+    auxillary_mask: int
+    address_bits: int
+    command_bits: int
+    # (address, command, toggle) to the symbols of a frame, without the padding
+    encode: Callable[[int, int, int], list[int]]
+
+def _lsb_first(value: int, bits: int) -> list[int]:
+    return [(value >> bit) & 1 for bit in range(bits)]
+
+def _msb_first(value: int, bits: int) -> list[int]:
+    return [(value >> bit) & 1 for bit in range(bits - 1, -1, -1)]
+
+# Pulse distance, a 562.5 us burst then a 562.5 us space for 0 or 1687.5 us for 1, LSB first
+def _encode_nec(address_bytes: list[int], command: int) -> list[int]:
+    symbols = [HIGH_A, LOW_B] # the 9 ms burst and 4.5 ms space of the leader, from the auxillary durations
+    for byte in address_bytes + [command, ~command & 0xFF]:
+        for bit in _lsb_first(byte, 8):
+            symbols += [HIGH_A, LOW_B if bit else LOW_A]
+    return symbols + [HIGH_A] # the final burst marks the end of the last space
+
+def _encode_nec_standard(address: int, command: int, toggle: int) -> list[int]:
+    return _encode_nec([address, ~address & 0xFF], command)
+
+def _encode_nec_extended(address: int, command: int, toggle: int) -> list[int]:
+    return _encode_nec([address & 0xFF, address >> 8], command)
+
+# Manchester, 1 is a space then a burst of 889 us each, 0 is a burst then a space, MSB first.
+# The second start bit is the inverted bit 6 of the command, as in extended RC5
+def _encode_rc5(address: int, command: int, toggle: int) -> list[int]:
+    bits = [1, (~command >> 6) & 1, toggle] + _msb_first(address, 5) + _msb_first(command & 0x3F, 6)
+    symbols = []
+    for bit in bits:
+        symbols += [LOW_A, HIGH_A] if bit else [HIGH_A, LOW_A]
+    return symbols
+
+# Pulse width, a 1200 us burst for 1 or 600 us for 0 then a 600 us space, LSB first
+def _encode_sirc(address_bits: int) -> Callable[[int, int, int], list[int]]:
+    def encode(address: int, command: int, toggle: int) -> list[int]:
+        symbols = [HIGH_A, LOW_A] # the 2.4 ms burst of the leader, from the auxillary duration, and a space
+        for bit in _lsb_first(command, 7) + _lsb_first(address, address_bits):
+            symbols += [HIGH_B if bit else HIGH_A, LOW_A]
+        return symbols
+    return encode
+
+_NEC_MAIN_US = (562.5, 1687.5, 562.5, None)
+_SIRC_MAIN_US = (600, None, 600, 1200)
+
+PROTOCOLS = {
+    "nec": Protocol(38_000, 108_000, _NEC_MAIN_US, (9000, 4500), 0b11, 8, 8, _encode_nec_standard),
+    "nec_extended": Protocol(38_000, 108_000, _NEC_MAIN_US, (9000, 4500), 0b11, 16, 8, _encode_nec_extended),
+    "rc5": Protocol(36_000, 113_778, (889, None, 889, None), (None, None), 0, 5, 7, _encode_rc5),
+    # The address of sirc20 is the 5 bit device followed by the 8 bit extended field
+    "sirc12": Protocol(40_000, 45_000, _SIRC_MAIN_US, (2400, None), 0b1, 5, 7, _encode_sirc(5)),
+    "sirc15": Protocol(40_000, 45_000, _SIRC_MAIN_US, (2400, None), 0b1, 8, 7, _encode_sirc(8)),
+    "sirc20": Protocol(40_000, 45_000, _SIRC_MAIN_US, (2400, None), 0b1, 13, 7, _encode_sirc(13)),
+}
+
+class IrProgram(NamedTuple):
+    registers: tuple[int, int, int, int, int] # reg_0 to reg_4, without commands
+    words: tuple[int, ...] # PROGRAM_DATA_MEM from word 0 on
+    symbols: tuple[int, ...] # the 2bpe symbols of a frame, padding included
+    frame_cycles: int # the duration of a frame in clock cycles, the program lasts repeat + 1 frames
+
+class _Timing(NamedTuple):
+    registers: RegisterImage # everything but the indices and the loop count
+    main_cycles: tuple[int, int, int, int]
+    auxillary_cycles: tuple[int, int]
+
+def _fit_durations(name: str, ticks: list[float]) -> tuple[int, list[int]]:
+    # The shared prescaler and the durations, see timing_index.nearest_durations
+    try:
+        prescaler, matches = timing_index.nearest_durations(ticks, max_error=MAX_ERROR)
+    except ValueError as error:
+        raise ValueError(f"The {name} durations do not fit at this clock frequency: {error}") from None
+    return prescaler, [match.duration for match in matches]
+
+@lru_cache(maxsize=None)
+def _protocol_timing(protocol: str, clock_hz: int) -> _Timing:
+    spec = PROTOCOLS[protocol]
+    ticks_per_us = clock_hz / 1e6
+
+    main_prescaler, used_durations = _fit_durations("main", [us * ticks_per_us for us in spec.main_us if us is not None])
+    used_durations = iter(used_durations)
+    main_durations = [0 if us is None else next(used_durations) for us in spec.main_us]
+    if spec.main_us[LOW_B] is None:
+        main_durations[LOW_B] = MAX_DURATION
+
+    auxillary_used = [us * ticks_per_us for us in spec.auxillary_us if us is not None]
+    auxillary_prescaler, auxillary_durations = _fit_durations("auxillary", auxillary_used) if auxillary_used else (0, [])
+    auxillary_durations = auxillary_durations + [0] * (2 - len(auxillary_durations))
+
+    carrier_duration = round(clock_hz / (2 * spec.carrier_hz)) - 1
+    if not 0 <= carrier_duration <= MAX_CARRIER_DURATION:
+        raise ValueError(f"A {spec.carrier_hz} Hz carrier can not be generated from a {clock_hz} Hz clock")
+
+    registers = RegisterImage(
+        use_2bpe=1,
+        carrier_en=1,
+        main_low_duration_a=main_durations[LOW_A],
+        main_low_duration_b=main_durations[LOW_B],
+        main_high_duration_a=main_durations[HIGH_A],
+        main_high_duration_b=main_durations[HIGH_B],
+        auxillary_mask=spec.auxillary_mask,
+        auxillary_duration_a=auxillary_durations[0],
+        auxillary_duration_b=auxillary_durations[1],
+        auxillary_prescaler=auxillary_prescaler,
+        main_prescaler=main_prescaler,
+        carrier_duration=carrier_duration,
+    )
+    main_cycles = tuple((duration + 2) << main_prescaler for duration in main_durations)
+    auxillary_cycles = tuple((duration + 2) << auxillary_prescaler for duration in auxillary_durations)
+    return _Timing(registers, main_cycles, auxillary_cycles)
+
+@lru_cache(maxsize=4096)
+def compile_command(protocol: str, address: int, command: int, repeat: int = 0, clock_hz: int = 64_000_000, toggle: int = 0) -> IrProgram:
+    """
+    Compile a remote control command, the results are cached.
+
+    Args:
+        protocol (str): One of PROTOCOLS
+        address (int): The address (device), of PROTOCOLS[protocol].address_bits
+        command (int): The command, of PROTOCOLS[protocol].command_bits
+        repeat (int): The number of times the frame is sent again, one frame period apart.
+            NEC sends the whole frame again rather than the repeat code,
+            as the 2.25 ms space of the repeat code would need a third leader duration
+        clock_hz (int): The clock frequency of the peripheral
+        toggle (int): The toggle bit of RC5, ignored by the other protocols
+
+    Returns:
+        IrProgram: The register image and program, start it with start_program
+    """
+    if protocol not in PROTOCOLS:
+        raise ValueError(f"Unknown protocol {protocol}, expected one of {', '.join(PROTOCOLS)}")
+    spec = PROTOCOLS[protocol]
+    if not 0 <= address < 1 << spec.address_bits:
+        raise ValueError(f"The address of {protocol} must be in the range 0 to {(1 << spec.address_bits) - 1}, not {address}")
+    if not 0 <= command < 1 << spec.command_bits:
+        raise ValueError(f"The command of {protocol} must be in the range 0 to {(1 << spec.command_bits) - 1}, not {command}")
+    if not 0 <= repeat <= MAX_REPEAT:
+        raise ValueError(f"repeat must be in the range 0 to {MAX_REPEAT}, not {repeat}")
+    if toggle not in (0, 1):
+        raise ValueError(f"toggle must be 0 or 1, not {toggle}")
+
+    timing = _protocol_timing(protocol, clock_hz)
+    symbols = spec.encode(address, command, toggle)
+    cycles = sum(timing.auxillary_cycles[symbol & 1] if index < 8 and (spec.auxillary_mask >> index) & 1 else timing.main_cycles[symbol]
+        for index, symbol in enumerate(symbols))
+
+    # Pad the frame up to the frame period, the shorter LOW_A makes up for the remainder
+    padding_cycles = max(0, round(spec.frame_period_us * clock_hz / 1e6) - cycles)
+    long_padding = padding_cycles // timing.main_cycles[LOW_B]
+    short_padding = round((padding_cycles - long_padding * timing.main_cycles[LOW_B]) / timing.main_cycles[LOW_A])
+    symbols += [LOW_B] * long_padding + [LOW_A] * short_padding
+    cycles += long_padding * timing.main_cycles[LOW_B] + short_padding * timing.main_cycles[LOW_A]
+    if len(symbols) > MAX_SYMBOLS:
+        raise ValueError(f"A {protocol} frame needs {len(symbols)} symbols at {clock_hz} Hz, more than {MAX_SYMBOLS}")
+
+    registers = timing.registers.copy()
+    registers.program_end_index = (len(symbols) - 1) * 2
+    registers.program_loop_count = repeat
+    return IrProgram(registers.to_registers(), tuple(program_image.pack_2bpe(symbols).tolist()), tuple(symbols), cycles)
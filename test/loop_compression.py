@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Compresses a 1bpe bit stream (e.g. a WS2812B frame) into programs that repeat their tail
+# with program_loopback_index and program_loop_count, like encoded_1bpe_test7 does by hand.
+#
+# The stream is cut into units (a pixel, or a group of bits), and each segment is a prefix
+# followed by a body that is repeated up to 256 times, both in PROGRAM_DATA_MEM from index 0:
+#   start_index = 0, loopback_index = the first bit of the body, end_index = its last bit
+# The segments are chosen by dynamic programming, for the fewest bytes uploaded, then the fewest
+# segments (host interventions). A segment is counted as its program words, reg_1 (its indices
+# and loop count) and the write of reg_0 that starts it. This is an upper bound: Device.run_frames
+# only writes the words and registers that differ from the previous segment, which depends on the
+# whole image left by the segments before, and is not tracked. upload_bytes() counts those.
+
+from typing import NamedTuple
+
+import numpy as np
+
+import program_image
+from register_image import FIELDS, NUM_REGISTERS, REGISTER_BYTES, RegisterImage
+
+MAX_REPEAT = 256 # program_loop_count + 1
+
+_INFINITE = 1 << 60 # a cost, can be added to itself
+
+# The registers holding the fields set by each segment
+_SEGMENT_REGISTERS = len({field.register for field in FIELDS
+    if field.name in ("program_start_index", "program_end_index", "program_loopback_index", "program_loop_count")})
+
+class Segment(NamedTuple):
+    registers: RegisterImage
+    words: list[int] # PROGRAM_DATA_MEM from word 0 on, only the words holding the program
+    num_bits: int # the bits transmitted, repetitions included
+
+def _repeats(units: np.ndarray, block: int) -> np.ndarray:
+    # The number of times the block of units starting at each index repeats back to back, up to MAX_REPEAT
+    count = len(units)
+    repeats = np.zeros(count + 1, dtype=np.int64)
+    if block > count:
+        return repeats
+    same = np.zeros(count, dtype=bool)
+    if 2 * block <= count:
+        equal = np.concatenate(([0], np.cumsum(units[:-block] == units[block:])))
+        same[:count - 2 * block + 1] = equal[block:count - block + 1] - equal[:count - 2 * block + 1] == block
+    repeats[:count - block + 1] = 1
+    for index in range(count - 2 * block, -1, -1):
+        if same[index]:
+            repeats[index] = min(repeats[index + block] + 1, MAX_REPEAT)
+    return repeats
+
+def compress_units(units, unit_bits: int, registers: RegisterImage) -> list[Segment]:
+    """
+    Compress a stream of units of unit_bits bits each, sent MSB first,
+    into the segments with the fewest bytes uploaded, then the fewest segments.
+
+    Args:
+        units: The value of each unit, in the order they are transmitted
+        unit_bits (int): The bits of a unit, a segment holds up to 256 // unit_bits of them
+        registers (RegisterImage): The configuration of the program (symbols, durations),
+            the indices, the loop count, loop_forever, downcount and use_2bpe are set by the segments
+
+    Returns:
+        list[Segment]: The segments, to run one after the other, e.g. with Device.run_frames
+    """
+    units = np.asarray(units, dtype=np.int64)
+    count = len(units)
+    capacity = program_image.PROGRAM_BITS // unit_bits
+    if capacity == 0:
+        raise ValueError(f"A unit of {unit_bits} bits does not fit in PROGRAM_DATA_MEM")
+    # repeats[body, index], 0 past the end of the stream
+    repeats = np.zeros((capacity + 1, count + capacity + 1), dtype=np.int64)
+    for block in range(1, capacity + 1):
+        repeats[block, :count + 1] = _repeats(units, block)
+
+    def words(num_units):
+        return -(-num_units * unit_bits // program_image.PROGRAM_WORD_BITS)
+
+    # Every (prefix, body) that fits in a segment, and what a segment of it adds to the cost
+    prefixes, bodies = (np.array(pair, dtype=np.int64) for pair in
+        zip(*((prefix, body) for prefix in range(capacity) for body in range(1, capacity - prefix + 1))))
+    scale = count + 1
+    added = REGISTER_BYTES * (_SEGMENT_REGISTERS + 1 + words(prefixes + bodies)) * scale + 1
+    no_loop_added = np.where(prefixes == 0, added, _INFINITE)
+    repeat_lookup = bodies * repeats.shape[1] + prefixes
+    repeats = repeats.reshape(-1)
+
+    # cost[index] is bytes * scale + segments to transmit the units from index on, i.e. (bytes, segments)
+    # compared in that order, and is infinite past the end of the stream.
+    # choice[index] is the (prefix, body, repeat) of the first segment
+    cost = np.full(count + capacity + 1, _INFINITE, dtype=np.int64)
+    cost[count] = 0
+    choice = [None] * (count + 1)
+    candidates = np.empty((len(prefixes), 2), dtype=np.int64)
+    for index in range(count - 1, -1, -1):
+        # Each (prefix, body) is a candidate without looping if there is no prefix,
+        # and one with the body repeated as many times as it is in the stream if that is more than once.
+        # The first best candidate is taken, in this order
+        repeat = repeats[repeat_lookup + index]
+        candidates[:, 0] = cost[index + bodies]
+        candidates[:, 0] += no_loop_added
+        candidates[:, 1] = cost[index + prefixes + bodies * repeat]
+        candidates[:, 1] += added
+        candidates[repeat < 2, 1] = _INFINITE
+
+        pair, looped = divmod(int(candidates.argmin()), 2)
+        cost[index] = candidates[pair, looped]
+        choice[index] = (int(prefixes[pair]), int(bodies[pair]), int(repeat[pair]) if looped else 1)
+
+    base = registers.copy()
+    base.use_2bpe = 0
+    base.downcount = 0
+    base.loop_forever = 0
+    base.program_start_index = 0
+
+    segments = []
+    index = 0
+    while index < count:
+        prefix, body, repeat = choice[index]
+        bits = ((units[index:index + prefix + body, None] >> np.arange(unit_bits - 1, -1, -1)) & 1).reshape(-1)
+        segment_registers = base.copy()
+        segment_registers.program_loopback_index = prefix * unit_bits if repeat > 1 else 0
+        segment_registers.program_end_index = len(bits) - 1
+        segment_registers.program_loop_count = repeat - 1
+        segments.append(Segment(segment_registers, program_image.pack_1bpe(bits)[:words(prefix + body)].tolist(),
+            (prefix + body * repeat) * unit_bits))
+        index += prefix + body * repeat
+    return segments
+
+def compress_bits(bits, registers: RegisterImage, unit_bits: int = 8) -> list[Segment]:
+    """
+    Compress a bit stream, its length must be a multiple of unit_bits.
+    Repetitions are only found at a multiple of unit_bits, smaller units find more
+    but take longer, in O(len(bits) * (256 / unit_bits) ** 2).
+    """
+    bits = np.asarray(bits, dtype=np.int64)
+    if len(bits) % unit_bits:
+        raise ValueError(f"The length of the bit stream must be a multiple of {unit_bits}, not {len(bits)}")
+    units = (bits.reshape(-1, unit_bits) << np.arange(unit_bits - 1, -1, -1)).sum(axis=1)
+    return compress_units(units, unit_bits, registers)
+
+def compress_pixels(pixels: np.ndarray, registers: RegisterImage, lut: np.ndarray = None, order: str = "GRB") -> list[Segment]:
+    """
+    Compress a WS2812B frame, as ws2812.encode_frame, with a pixel per unit.
+    """
+    pixels = np.asarray(pixels)
+    if pixels.ndim != 2 or pixels.shape[1] != 3 or pixels.dtype != np.uint8:
+        raise ValueError(f"pixels must be a (N, 3) uint8 array, not {pixels.shape} {pixels.dtype}")
+    channels = pixels[:, ["RGB".index(channel) for channel in order]]
+    if lut is not None:
+        channels = lut[channels]
+    channels = channels.astype(np.int64)
+    return compress_units(channels[:, 0] << 16 | channels[:, 1] << 8 | channels[:, 2], 24, registers)
+
+def upload_bytes(segments: list[Segment]) -> int:
+    """
+    The bytes written to run the segments one after the other from reset, as Device.run_frames does:
+    the registers and words that changed, and a 32 bit write of reg_0 to start each one.
+    """
+    registers = [None] * NUM_REGISTERS
+    words = [None] * program_image.NUM_PROGRAM_WORDS
+    total = 0
+    for segment in segments:
+        for index in range(1, NUM_REGISTERS):
+            value = segment.registers.register(index)
+            if registers[index] != value:
+                registers[index] = value
+                total += REGISTER_BYTES
+        for index, word in enumerate(segment.words):
+            if words[index] != word:
+                words[index] = word
+                total += REGISTER_BYTES
+        total += REGISTER_BYTES
+    return total
@@ -0,0 +1,155 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Records every change of an output (e.g. uo_out) into preallocated NumPy arrays,
+# so that it can be compared against a pulse_model schedule afterwards
+# instead of asserting on every clock cycle during the simulation.
+
+import cocotb
+from cocotb.triggers import Edge, Event, ReadOnly
+from cocotb.utils import get_sim_time
+
+import numpy as np
+
+class OutputCapture:
+    """
+    Background monitor of an output, recording (sim time, value) on every change.
+
+    Nothing is recorded, and the monitor does not wake up, until start() is called.
+    With ring=True, only the last `capacity` changes are kept, otherwise the arrays grow as needed.
+    """
+    def __init__(self, signal, capacity: int = 1 << 16, ring: bool = False):
+        self.signal = signal
+        self.ring = ring
+        self.times = np.zeros(capacity, dtype=np.int64)   # ps
+        self.values = np.zeros(capacity, dtype=np.uint8)
+        self.count = 0 # total number of changes recorded, may be more than the capacity in ring mode
+        self.start_time = None
+        self.stop_time = None
+        self._running = False
+        self._wake = Event()
+        self._task = cocotb.start_soon(self._monitor())
+
+    # Starts a new capture window, the current value is recorded as the first change
+    def start(self):
+        self.count = 0
+        self.start_time = int(get_sim_time("ps"))
+        self.stop_time = None
+        self._record(self.start_time, int(self.signal.value))
+        self._running = True
+        self._wake.set()
+
+    def stop(self):
+        self.stop_time = int(get_sim_time("ps"))
+        self._running = False
+
+    def kill(self):
+        self._task.kill()
+
+    def _record(self, time: int, value: int):
+        capacity = len(self.times)
+        if self.count == capacity and not self.ring:
+            self.times = np.resize(self.times, capacity * 2)
+            self.values = np.resize(self.values, capacity * 2)
+            capacity *= 2
+        index = self.count % capacity
+        self.times[index] = time
+        self.values[index] = value
+        self.count += 1
+
+    async def _monitor(self):
+        edge = Edge(self.signal)
+        read_only = ReadOnly()
+        while True:
+            if not self._running:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            await edge
+            if not self._running:
+                continue
+
+            # Only record the settled value, once per time step
+            await read_only
+            value = int(self.signal.value)
+            if value != self.values[(self.count - 1) % len(self.values)]:
+                self._record(int(get_sim_time("ps")), value)
+
+    # The recorded changes in order, the oldest ones may have been dropped in ring mode
+    def samples(self) -> tuple[np.ndarray, np.ndarray]:
+        capacity = len(self.times)
+        if self.count <= capacity:
+            return self.times[:self.count], self.values[:self.count]
+        first = self.count % capacity
+        return np.roll(self.times, -first), np.roll(self.values, -first)
+
+    def runs(self, origin_time: int, period: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The capture as runs of clock cycles, like pulse_model.PulseSchedule.
+
+        Args:
+            origin_time (int): The time of cycle 0 in ps, changes before it are dropped
+            period (int): The clock period in ps
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The first cycle of each run and its value
+        """
+        times, values = self.samples()
+        # The output changes right after a rising edge, so this is the cycle of the change
+        cycles = (times - origin_time) // period
+        keep = cycles >= 0
+        if not keep[0]:
+            # The value at cycle 0 is the last one before it
+            first = int(np.argmax(keep)) - 1 if keep.any() else len(keep) - 1
+            keep[first] = True
+            cycles[first] = 0
+        return cycles[keep], values[keep]
+
+    def compare(self, durations: np.ndarray, values: np.ndarray, origin_time: int, period: int, mask: int = 0xFF, max_report: int = 10) -> list[str]:
+        """
+        Compare the capture against expected runs, e.g. from a pulse_model.PulseSchedule.
+        Only the cycles that are covered by both are compared.
+
+        Args:
+            durations (np.ndarray): The expected runs, in clock cycles from cycle 0
+            values (np.ndarray): The expected value of each run
+            origin_time (int): The time of cycle 0 in ps
+            period (int): The clock period in ps
+            mask (int): The bits of the value to compare
+            max_report (int): The maximum number of mismatches to describe
+
+        Returns:
+            list[str]: The first mismatches, empty if everything matched
+        """
+        expected_starts = np.concatenate(([0], np.cumsum(durations, dtype=np.int64)[:-1]))
+        expected_end = int(np.sum(durations, dtype=np.int64))
+        captured_starts, captured_values = self.runs(origin_time, period)
+
+        end = expected_end
+        if self.stop_time is not None:
+            end = min(end, (self.stop_time - origin_time) // period)
+        begin = max(0, int(captured_starts[0]) if len(captured_starts) else end)
+
+        # Evaluate both at every cycle where either of them changes
+        points = np.union1d(expected_starts, captured_starts)
+        points = points[(points >= begin) & (points < end)]
+        expected = values[np.searchsorted(expected_starts, points, side="right") - 1]
+        captured = captured_values[np.searchsorted(captured_starts, points, side="right") - 1]
+
+        # Report each stretch of cycles with the same mismatch once
+        difference = (expected ^ captured) & mask
+        stretch_starts = np.flatnonzero(np.concatenate(([True], difference[1:] != difference[:-1])))[:len(points)]
+        stretch_ends = np.append(points[stretch_starts[1:]], end)
+        mismatch = np.flatnonzero(difference[stretch_starts] != 0)
+
+        report = []
+        for stretch in mismatch[:max_report].tolist():
+            index = stretch_starts[stretch]
+            cycle = int(points[index])
+            pins = [pin for pin in range(8) if int(difference[index]) & (1 << pin)]
+            report.append(f'cycle {cycle} ({(origin_time + cycle * period) / 1000} ns) for {int(stretch_ends[stretch]) - cycle} cycles: '
+                          f'expected {int(expected[index]):08b}, got {int(captured[index]):08b}, pins {pins}')
+        if len(mismatch) > max_report:
+            report.append(f'... and {len(mismatch) - max_report} more')
+        return report
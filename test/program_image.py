@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Packs a program into the memory image of PROGRAM_DATA_MEM in one vectorized pass,
+# for generating many programs quickly (e.g. LED animations or fuzzing).
+
+import numpy as np
+
+PROGRAM_BITS = 256 # must be power of 2, the program counter wraps around
+PROGRAM_WORD_BITS = 32
+NUM_PROGRAM_WORDS = PROGRAM_BITS // PROGRAM_WORD_BITS
+
+_OFFSETS = np.arange(PROGRAM_BITS, dtype=np.intp)
+
+def _as_array(program) -> np.ndarray:
+    # bytes-like input has one element per byte
+    if isinstance(program, (bytes, bytearray, memoryview)):
+        return np.frombuffer(program, dtype=np.uint8)
+    array = np.asarray(program)
+    # An empty list would be an array of floats
+    return array if array.size else array.astype(np.uint8)
+
+def _to_words(bits: np.ndarray) -> memoryview:
+    # Bit n of the image is bit n % 32 of word n // 32
+    words = np.packbits(bits, bitorder="little").view("<u4").astype(np.uint32, copy=False)
+    return memoryview(words)
+
+def _positions(num_elements: int, bits_per_element: int, start: int, downcount: bool) -> np.ndarray:
+    # The program counter of each element, in the order they are executed
+    step = -bits_per_element if downcount else bits_per_element
+    return (start + step * _OFFSETS[:num_elements]) & (PROGRAM_BITS - 1)
+
+def pack_1bpe(program, start: int = 0, downcount: bool = False) -> memoryview:
+    """
+    Pack a 1bpe program, each element is a bit.
+
+    Args:
+        program: The bits in the order they are executed, as a NumPy array, a list or bytes-like with one bit per byte
+        start (int): The program counter of the first element, as config_program_start_index.
+            The elements after it wrap around the end of the memory
+        downcount (bool): Lay out the elements at decreasing program counters, for config_downcount
+
+    Returns:
+        memoryview: The 8 words of PROGRAM_DATA_MEM, the bits not covered by the program are 0
+    """
+    bits = _as_array(program)
+    if bits.ndim != 1 or len(bits) > PROGRAM_BITS:
+        raise ValueError(f"A 1bpe program must be a sequence of up to {PROGRAM_BITS} bits")
+    if len(bits) and (bits.min() < 0 or bits.max() > 1):
+        raise ValueError("The elements of a 1bpe program must be 0 or 1")
+
+    image = np.zeros(PROGRAM_BITS, dtype=np.uint8)
+    image[_positions(len(bits), 1, start, downcount)] = bits
+    return _to_words(image)
+
+def pack_2bpe(program, start: int = 0, downcount: bool = False) -> memoryview:
+    """
+    Pack a 2bpe program, each element is a symbol of 2 bits (transmit level, duration selector).
+
+    Args:
+        program: The symbols in the order they are executed, either as a N x 2 array (or list of tuples)
+            of (duration_selector, transmit_level), or as a 1 dimensional array or bytes-like of
+            the symbol values transmit_level << 1 | duration_selector
+        start (int): The program counter of the first element, as config_program_start_index, must be even.
+            The elements after it wrap around the end of the memory
+        downcount (bool): Lay out the elements at decreasing program counters, for config_downcount
+
+    Returns:
+        memoryview: The 8 words of PROGRAM_DATA_MEM, the bits not covered by the program are 0
+    """
+    symbols = _as_array(program)
+    if symbols.ndim == 2 and symbols.shape[1] == 2:
+        duration_selectors, transmit_levels = symbols[:, 0], symbols[:, 1]
+        if len(symbols) and (symbols.min() < 0 or symbols.max() > 1):
+            raise ValueError("The duration selector and transmit level of a 2bpe symbol must be 0 or 1")
+    elif symbols.ndim == 1:
+        duration_selectors, transmit_levels = symbols & 1, symbols >> 1
+        if len(symbols) and (symbols.min() < 0 or symbols.max() > 3):
+            raise ValueError("The symbols of a 2bpe program must be in the range 0 to 3")
+    else:
+        raise ValueError("A 2bpe program must be a sequence of symbols or of (duration_selector, transmit_level)")
+    if len(symbols) > PROGRAM_BITS // 2:
+        raise ValueError(f"A 2bpe program must have up to {PROGRAM_BITS // 2} symbols")
+    if start & 1:
+        raise ValueError(f"The start of a 2bpe program must be even, not {start}")
+
+    positions = _positions(len(symbols), 2, start, downcount)
+    image = np.zeros(PROGRAM_BITS, dtype=np.uint8)
+    image[positions] = duration_selectors
+    image[positions + 1] = transmit_levels
+    return _to_words(image)
@@ -0,0 +1,210 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Streams a program of any length through PROGRAM_DATA_MEM, using it as a ring of two halves
+# that are refilled while the other one is being transmitted.
+
+from itertools import islice
+from typing import Iterable, NamedTuple
+
+import cocotb
+from cocotb.triggers import Event, FallingEdge, Timer
+from cocotb.utils import get_sim_time
+
+from output_capture import OutputCapture
+import program_image
+import pulse_model
+from register_image import Interrupt
+
+HALF_BITS = program_image.PROGRAM_BITS // 2
+HALF_WORDS = program_image.NUM_PROGRAM_WORDS // 2
+STATUS_POLL_CYCLES = 32 # between two reads of the status, while waiting for the program counter to wrap around
+
+class StreamReport(NamedTuple):
+    elements: int # the elements transmitted
+    refills: int # the halves written while the program was running
+    underruns: int # the times the program ran out of elements before the end of the stream, and was started again
+    # The fewest cycles between the end of a refill and the end, on the output, of the element before the refilled ones,
+    # None without refills. Negative if the program had already ended, see ProgramStream
+    min_slack_cycles: int | None
+
+class ProgramStream:
+    """
+    Transmits the elements of `elements` (bits in 1bpe, symbols in 2bpe, as accepted by program_image)
+    with the current configuration of `device`, however many there are.
+
+    The program runs from index 0 without loop_forever and with the loop count at 0, and program_end_index
+    follows the last element written, so the program counter wraps around the memory by itself
+    and the program ends at the tail of the stream, or wherever the refills could not keep up.
+    The first half is refilled on the program counter mid interrupt.
+
+    The second half has no interrupt: the program counter wraps around without a loop event.
+    Looping at the end of the memory under loop_forever would raise the loop interrupt,
+    but the loop counter is only loaded when the program starts and is decremented by every loop,
+    so the program could no longer be made to end at a tail that is not known in advance,
+    and a late refill would transmit stale elements instead of ending the program.
+    Instead, the status is polled until the program counter has wrapped around to the first half,
+    as a host driver would, so that program_end_index is not moved while the program counter is still on it.
+
+    The elements transmitted are counted on the output, from the symbol toggle, and the slack of a refill
+    is measured against the end of the element before it on the output. A refill must land a few cycles
+    before that, when the next element is requested (see status_sampler_test1), so a refill with a small
+    positive slack may still be an underrun.
+
+    Overwrites the start, end, loopback and loop count fields, loop_forever, downcount and the interrupt enables.
+    period is the clock period in ps, host_latency_cycles delays every refill, to model a slow host.
+    """
+    def __init__(self, device, elements: Iterable, period: int, host_latency_cycles: int = 0):
+        self.device = device
+        self.period = period
+        self.host_latency_cycles = host_latency_cycles
+        self.origin_time = None # cycle 0 of the latest run, as in pulse_model
+        self.elements = 0
+        self.refills = 0
+        self.underruns = 0
+        self.min_slack_cycles = None
+        self._elements = iter(elements)
+        self._carry = [] # elements to transmit before the rest of the iterator
+        self._exhausted = False
+        self._end_event = Event()
+
+    def _take(self, count: int) -> list:
+        chunk = self._carry[:count]
+        self._carry = self._carry[count:]
+        if len(chunk) < count and not self._exhausted:
+            more = list(islice(self._elements, count - len(chunk)))
+            self._exhausted = len(chunk) + len(more) < count
+            chunk += more
+        return chunk
+
+    def _done(self) -> bool:
+        return self._exhausted and not self._carry
+
+    async def run(self) -> StreamReport:
+        device = self.device
+        device.config_program_start_index = 0
+        device.config_program_loopback_index = 0
+        device.config_program_loop_count = 0
+        device.config_loop_forever = 0
+        device.config_downcount = 0
+        device.config_timer_interrupt_en = 0
+        device.config_program_loop_interrupt_en = 0
+        device.config_program_end_interrupt_en = 1
+        device.config_program_counter_mid_interrupt_en = 1
+        self._step = 2 if device.config_use_2bpe else 1
+        self._half_elements = HALF_BITS // self._step
+        self._symbols = 1 if device.config_use_2bpe else 2 # per element, see pulse_model.element_symbols
+
+        self._toggles = OutputCapture(device.dut.symbol_toggle_out)
+        try:
+            chunk = self._take(2 * self._half_elements)
+            while chunk:
+                await self._start(chunk)
+                played = await self._stream()
+                self.elements += played
+                unplayed = self._run_elements[played:]
+                if not unplayed and self._done():
+                    break
+                self.underruns += 1
+                self._carry = unplayed + self._carry
+                chunk = self._take(2 * self._half_elements)
+        finally:
+            self._toggles.stop()
+            self._toggles.kill()
+
+        return StreamReport(self.elements, self.refills, self.underruns, self.min_slack_cycles)
+
+    async def _start(self, chunk: list):
+        device = self.device
+        self._run_elements = []
+        # (the index of the first element written, the sim time once written) of each refill
+        self._refill_times = []
+
+        end_index = await self._write_half(0, chunk[:self._half_elements])
+        if len(chunk) > self._half_elements:
+            end_index = await self._write_half(1, chunk[self._half_elements:])
+        device.config_program_end_index = end_index
+        await device.write_config()
+        await device.clear_interrupts()
+
+        self._end_event.clear()
+        self._toggles.start()
+        valid = cocotb.start_soon(device.wait_for_valid_output())
+        await device.start_program()
+        self.origin_time = await valid
+        cocotb.start_soon(self._watch_end())
+
+    # Records when the output stops being valid, i.e. the end of the program
+    async def _watch_end(self):
+        await FallingEdge(self.device.dut.valid_out)
+        self._end_time = int(get_sim_time("ps"))
+        self._end_event.set()
+
+    # Packs and writes the elements to half of the memory, returns the index of the last one
+    async def _write_half(self, half: int, chunk: list) -> int:
+        start = half * HALF_BITS
+        pack = program_image.pack_2bpe if self._step == 2 else program_image.pack_1bpe
+        words = pack(chunk, start)[half * HALF_WORDS:(half + 1) * HALF_WORDS].tolist()
+        self._run_elements += chunk
+        await self.device.write_program_words(words, half * HALF_WORDS)
+        return start + (len(chunk) - 1) * self._step
+
+    # Polls the status until the program counter has wrapped around to the first half,
+    # returns False if the program has ended first
+    async def _wait_for_wrap(self) -> bool:
+        while True:
+            status = await self.device.read_status()
+            if not status.program_running or status.interrupts & Interrupt.PROGRAM_END:
+                return False
+            if status.program_counter < HALF_BITS:
+                return True
+            await Timer(STATUS_POLL_CYCLES * self.period, "ps")
+
+    # Refills the halves until the stream is done or the program has ended,
+    # returns the number of elements transmitted
+    async def _stream(self) -> int:
+        device = self.device
+        half = 0
+        while not self._done():
+            if half == 0:
+                # Wait until the program counter reaches the second half
+                status = await device.wait_for_interrupt(Interrupt.PROGRAM_COUNTER_MID | Interrupt.PROGRAM_END)
+                if status.interrupts & Interrupt.PROGRAM_END:
+                    break
+                await device.clear_interrupts(0, 0, 0, 1)
+            elif not await self._wait_for_wrap():
+                break
+            await self._refill(half)
+            half ^= 1
+
+        await self._end_event.wait()
+        await device.clear_interrupts()
+
+        # The first symbol starts when the output becomes valid, and the symbol toggle changes as each of the others starts
+        valid_time = self.origin_time + pulse_model.START_LATENCY * self.period
+        times, _ = self._toggles.samples()
+        starts = [valid_time] + [time for time in times[1:].tolist() if valid_time < time < self._end_time]
+        assert len(starts) % self._symbols == 0, f"The program ended on {len(starts)} symbols, which is not the end of an element"
+        played = len(starts) // self._symbols
+
+        # The element before the refilled ones ends where the first of them starts, or where the program ended
+        for first, time in self._refill_times:
+            end_time = starts[first * self._symbols] if first < played else self._end_time
+            slack = (end_time - time) // self.period
+            self.min_slack_cycles = slack if self.min_slack_cycles is None else min(self.min_slack_cycles, slack)
+        return played
+
+    async def _refill(self, half: int):
+        if self.host_latency_cycles:
+            await Timer(self.host_latency_cycles * self.period, "ps")
+        chunk = self._take(self._half_elements)
+        if not chunk:
+            # The stream ended with the other half, where the program already ends
+            return
+
+        first = len(self._run_elements)
+        end_index = await self._write_half(half, chunk)
+        self.device.config_program_end_index = end_index
+        await self.device.write32_reg_1()
+        self._refill_times.append((first, int(get_sim_time("ps"))))
+        self.refills += 1
@@ -0,0 +1,351 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Cycle accurate reference model of tqvp_hx2003_pulse_transmitter (src/peripheral.v)
+#
+# Given the register image (reg_0 to reg_4) and the program data memory,
+# simulate() returns what the peripheral outputs after the program is started, carrier included,
+# as run-length encoded NumPy arrays instead of a value per clock cycle.
+#
+# Cycle 0 is the first clock cycle after the rising edge on which start_program is written.
+
+from typing import NamedTuple
+
+import numpy as np
+
+from register_image import RegisterImage
+
+NUM_PROGRAM_WORDS = 8
+PROGRAM_COUNTER_WRAP = 256
+
+# uo_out pins
+PIN_VALID = 0            # uo_out[1:0]
+PIN_INTERRUPT = 2
+PIN_SYMBOL_TOGGLE = 3
+PIN_CARRIER = 4
+PIN_PULSE = 5            # uo_out[7:5]
+
+VALID_MASK = 0b0000_0011
+PULSE_MASK = 0b1110_0000
+
+# Bits of the interrupt status, reg_0[3:0]
+INTERRUPT_TIMER = 0b0001
+INTERRUPT_LOOP = 0b0010
+INTERRUPT_END = 0b0100
+INTERRUPT_MID = 0b1000
+
+# The program status goes high on cycle 0, the first symbol is fetched during cycle 1
+# and the output becomes valid on cycle 3, see start_pulse_delayed_2
+START_LATENCY = 3
+
+# simulate() stops after this many symbols, in case the program never reaches its end
+MAX_SYMBOLS = 1 << 20
+
+# The fields of the register image that affect the output
+class PulseConfig(NamedTuple):
+    interrupt_status: int
+    interrupt_enable_mask: int
+    loop_forever: int
+    idle_level: int
+    invert_output: int
+    carrier_en: int
+    downcount: int
+    use_2bpe: int
+    symbol_lut: tuple[int, int, int, int] # low_symbol_0, low_symbol_1, high_symbol_0, high_symbol_1
+    program_start_index: int
+    program_end_index: int
+    program_loopback_index: int
+    program_loop_count: int
+    main_durations: tuple[int, int, int, int] # low_a, low_b, high_a, high_b
+    auxillary_mask: int
+    auxillary_durations: tuple[int, int] # a, b
+    auxillary_prescaler: int
+    main_prescaler: int
+    carrier_duration: int
+
+def decode_registers(registers: tuple[int, int, int, int, int]) -> PulseConfig:
+    # reg_0[3:0] is the interrupt status when the program is started, see Device._gen_registers
+    image = RegisterImage.from_registers(registers)
+    return PulseConfig(
+        interrupt_status = registers[0] & 0xF,
+        interrupt_enable_mask = image.timer_interrupt_en | (image.program_loop_interrupt_en << 1)
+            | (image.program_end_interrupt_en << 2) | (image.program_counter_mid_interrupt_en << 3),
+        loop_forever = image.loop_forever,
+        idle_level = image.idle_level,
+        invert_output = image.invert_output,
+        carrier_en = image.carrier_en,
+        downcount = image.downcount,
+        use_2bpe = image.use_2bpe,
+        symbol_lut = (image.low_symbol_0, image.low_symbol_1, image.high_symbol_0, image.high_symbol_1),
+        program_start_index = image.program_start_index,
+        program_end_index = image.program_end_index,
+        program_loopback_index = image.program_loopback_index,
+        program_loop_count = image.program_loop_count,
+        main_durations = (image.main_low_duration_a, image.main_low_duration_b, image.main_high_duration_a, image.main_high_duration_b),
+        auxillary_mask = image.auxillary_mask,
+        auxillary_durations = (image.auxillary_duration_a, image.auxillary_duration_b),
+        auxillary_prescaler = image.auxillary_prescaler,
+        main_prescaler = image.main_prescaler,
+        carrier_duration = image.carrier_duration,
+    )
+
+class PulseSchedule(NamedTuple):
+    # uo_out as runs: uo_out is values[i] for durations[i] cycles, starting from cycle 0.
+    # The last run is the state after the program has ended (or was truncated)
+    durations: np.ndarray           # uint32
+    values: np.ndarray              # uint8
+    # The transmitted symbols, in order
+    symbol_durations: np.ndarray    # uint32, cycles
+    symbol_levels: np.ndarray       # uint8, transmit level before inversion
+    # Interrupt events as the cycle where they are first visible in the interrupt status,
+    # and the reg_0[3:0] bits they set, before applying the interrupt enable mask
+    interrupt_cycles: np.ndarray    # uint32
+    interrupt_sources: np.ndarray   # uint8
+    # The first cycle on which the output is no longer valid
+    end_cycle: int
+    # Whether simulate() gave up before the program ended
+    truncated: bool
+
+    # Returns the runs of a single uo_out pin, merging consecutive runs of the same level
+    def pin_runs(self, pin: int, start_cycle: int = 0) -> tuple[np.ndarray, np.ndarray]:
+        durations, values = slice_runs(self.durations, self.values, start_cycle)
+        return merge_runs(durations, (values >> pin) & 1)
+
+# Drops the runs (or the part of a run) before start_cycle
+def slice_runs(durations: np.ndarray, values: np.ndarray, start_cycle: int) -> tuple[np.ndarray, np.ndarray]:
+    ends = np.cumsum(durations, dtype=np.uint64)
+    first = int(np.searchsorted(ends, start_cycle, side="right"))
+    durations = durations[first:].copy()
+    if len(durations):
+        durations[0] = ends[first] - start_cycle
+    return durations, values[first:]
+
+# Merges consecutive runs with the same value, and drops empty runs
+def merge_runs(durations: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    keep = durations > 0
+    durations = durations[keep]
+    values = values[keep]
+    if len(values) == 0:
+        return durations, values
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    return np.add.reduceat(durations, starts, dtype=np.uint32), values[starts]
+
+def _read_symbol(config: PulseConfig, program: list[int], program_counter: int, sequence_done_in_1bpe: int) -> tuple[int, int, int]:
+    """
+    Decode the symbol at program_counter, like the combinatorics after PROGRAM_DATA_MEM.
+
+    Returns:
+        tuple[int, int, int]: The duration in clock cycles, the prescaler and the transmit level
+    """
+    data_32 = program[program_counter >> 5]
+
+    if config.use_2bpe:
+        symbol = (data_32 >> (program_counter & 0b11110)) & 0b11
+        use_auxillary = program_counter < 16 and (config.auxillary_mask >> (program_counter >> 1)) & 1
+    else:
+        bit = (data_32 >> (program_counter & 0b11111)) & 1
+        symbol = config.symbol_lut[(bit << 1) | sequence_done_in_1bpe]
+        use_auxillary = program_counter < 8 and (config.auxillary_mask >> program_counter) & 1
+
+    if use_auxillary:
+        duration = config.auxillary_durations[symbol & 1]
+        prescaler = config.auxillary_prescaler
+    else:
+        duration = config.main_durations[symbol]
+        prescaler = config.main_prescaler
+
+    return (duration + 2) << prescaler, prescaler, symbol >> 1
+
+def element_symbols(config: PulseConfig, program: list[int], program_counter: int) -> list[tuple[int, int, int]]:
+    """
+    Decode the symbols of the element at program_counter, 1 in 2bpe and 2 in 1bpe.
+
+    Returns:
+        list[tuple[int, int, int]]: The duration in clock cycles, the prescaler and the transmit level of each symbol
+    """
+    if config.use_2bpe:
+        return [_read_symbol(config, program, program_counter, 0)]
+    return [_read_symbol(config, program, program_counter, sequence_done_in_1bpe) for sequence_done_in_1bpe in (0, 1)]
+
+def program_words_used(registers: tuple[int, int, int, int, int]) -> int:
+    """
+    The PROGRAM_DATA_MEM words the program reads, from its start index to its end index,
+    and from the loopback index to the end index if it loops.
+
+    Returns:
+        int: A bit mask, bit n is set if PROGRAM_DATA_MEM[n] is read
+    """
+    config = decode_registers(registers)
+    step = 2 if config.use_2bpe else 1
+    if config.downcount:
+        step = -step
+
+    starts = [config.program_start_index]
+    if config.loop_forever or config.program_loop_count:
+        starts.append(config.program_loopback_index)
+
+    mask = 0
+    for program_counter in starts:
+        # A program that never reaches its end index reads all of the memory
+        for _ in range(PROGRAM_COUNTER_WRAP):
+            mask |= 1 << (program_counter >> 5)
+            if program_counter == config.program_end_index:
+                break
+            program_counter = (program_counter + step) % PROGRAM_COUNTER_WRAP
+    return mask
+
+def program_cycles(registers: tuple[int, int, int, int, int], program: list[int], num_symbols: int) -> int:
+    """
+    The total duration of the first num_symbols symbols in program data memory,
+    regardless of where the program starts, ends and loops.
+    """
+    config = decode_registers(registers)
+    program = list(program) + [0] * (NUM_PROGRAM_WORDS - len(program))
+
+    if config.use_2bpe:
+        symbols = ((program_counter << 1, 0) for program_counter in range(num_symbols))
+    else:
+        symbols = ((symbol >> 1, symbol & 1) for symbol in range(num_symbols))
+
+    return sum(_read_symbol(config, program, program_counter, sequence_done_in_1bpe)[0] for program_counter, sequence_done_in_1bpe in symbols)
+
+def simulate(registers: tuple[int, int, int, int, int], program: list[int], max_loops: int = None, tail_cycles: int = 1) -> PulseSchedule:
+    """
+    Simulate the peripheral from the start of the program until it ends.
+
+    Args:
+        registers (tuple[int, int, int, int, int]): reg_0 to reg_4, as they are when the program starts,
+            reg_0[3:0] is the interrupt status at that time
+        program (list[int]): PROGRAM_DATA_MEM[0] to PROGRAM_DATA_MEM[7], missing words are taken as 0
+        max_loops (int): Stop after the program has looped this many times (for loop_forever)
+        tail_cycles (int): The duration of the last run, after the program has ended
+
+    Returns:
+        PulseSchedule: The expected outputs and interrupt events
+    """
+    config = decode_registers(registers)
+    program = list(program) + [0] * (NUM_PROGRAM_WORDS - len(program))
+
+    # Walk the program counter like the always @(posedge clk) block,
+    # one iteration per countdown_timer_request_data_event
+    step = 2 if config.use_2bpe else 1
+    if config.downcount:
+        step = -step
+
+    symbol_durations = []
+    symbol_levels = []
+    # The requests that raise an interrupt event
+    request_symbols = []
+    request_prescalers = []
+    request_sources = []
+
+    program_counter = config.program_start_index
+    program_loop_counter = config.program_loop_count
+    sequence_done_in_1bpe = 0
+    loops = 0
+    truncated = False
+
+    while True:
+        duration, prescaler, level = _read_symbol(config, program, program_counter, sequence_done_in_1bpe)
+        symbol_durations.append(duration)
+        symbol_levels.append(level)
+
+        # The request for the next symbol
+        sources = 0
+        program_end_of_file = False
+        if config.use_2bpe or sequence_done_in_1bpe:
+            if program_counter == 128:
+                sources |= INTERRUPT_MID
+
+            if program_counter == config.program_end_index:
+                if not config.loop_forever and program_loop_counter == 0:
+                    program_end_of_file = True
+                else:
+                    sources |= INTERRUPT_LOOP
+                    program_counter = config.program_loopback_index
+                    program_loop_counter = (program_loop_counter - 1) % 256
+                    loops += 1
+            else:
+                program_counter = (program_counter + step) % PROGRAM_COUNTER_WRAP
+        sequence_done_in_1bpe ^= 1
+
+        if sources:
+            request_symbols.append(len(symbol_durations) - 1)
+            request_prescalers.append(prescaler)
+            request_sources.append(sources)
+
+        if program_end_of_file:
+            break
+        if (max_loops is not None and loops >= max_loops) or len(symbol_durations) >= MAX_SYMBOLS:
+            truncated = True
+            break
+
+    symbol_durations = np.array(symbol_durations, dtype=np.uint32)
+    symbol_levels = np.array(symbol_levels, dtype=np.uint8)
+    symbol_ends = START_LATENCY + np.cumsum(symbol_durations, dtype=np.int64)
+    symbol_starts = symbol_ends - symbol_durations
+    end_cycle = int(symbol_ends[-1])
+
+    # Interrupt events
+    # The countdown timer pulses when a symbol is done, except for the initial load,
+    # the program end is flagged with the pulse of the last symbol.
+    # The request for the next symbol comes one tick before that, where a tick is 1 << prescaler cycles
+    request_symbols = np.array(request_symbols, dtype=np.int64)
+    request_ticks = np.left_shift(1, np.array(request_prescalers, dtype=np.int64))
+    request_cycles = symbol_ends[request_symbols] - 1 - request_ticks
+
+    timer_sources = np.full(len(symbol_ends), INTERRUPT_TIMER, dtype=np.uint8)
+    if not truncated:
+        timer_sources[-1] |= INTERRUPT_END
+
+    interrupt_cycles = np.concatenate((request_cycles, symbol_ends))
+    interrupt_sources = np.concatenate((np.array(request_sources, dtype=np.uint8), timer_sources))
+    order = np.argsort(interrupt_cycles, kind="stable")
+    interrupt_cycles = interrupt_cycles[order].astype(np.uint32)
+    interrupt_sources = interrupt_sources[order]
+
+    # user_interrupt is sticky, so it changes once at most
+    if config.interrupt_status & config.interrupt_enable_mask:
+        interrupt_rise = 0
+    else:
+        enabled = np.flatnonzero(interrupt_sources & config.interrupt_enable_mask)
+        interrupt_rise = int(interrupt_cycles[enabled[0]]) if len(enabled) else None
+
+    # The carrier timer is held in reset while the output is not valid, then
+    # it toggles every carrier_duration + 1 cycles, starting low
+    carrier_half_period = config.carrier_duration + 1
+    carrier_edges = np.arange(START_LATENCY + carrier_half_period, end_cycle, carrier_half_period, dtype=np.int64)
+
+    # Build the runs from the boundaries of the symbols, the carrier and the interrupt,
+    # there is nothing to say about the state after a truncated program
+    last_cycle = end_cycle if truncated else end_cycle + tail_cycles
+    boundaries = [[0, START_LATENCY, end_cycle], symbol_starts, carrier_edges]
+    if interrupt_rise is not None:
+        boundaries.append([interrupt_rise])
+    starts = np.unique(np.concatenate(boundaries).astype(np.int64))
+    starts = starts[starts < last_cycle]
+
+    valid = (starts >= START_LATENCY) & (starts < end_cycle)
+    symbol_index = np.minimum(np.searchsorted(symbol_ends, starts, side="right"), len(symbol_levels) - 1)
+
+    carrier = valid & (((starts - START_LATENCY) // carrier_half_period) & 1).astype(bool)
+
+    idle = config.idle_level
+    level = symbol_levels[symbol_index].astype(bool)
+    if config.carrier_en:
+        level &= carrier
+    level = np.where(valid, level, idle) ^ config.invert_output
+    # Starts low once the first symbol is fetched, and toggles after every symbol
+    toggle = np.where(valid, symbol_index & 1, idle)
+    interrupt = np.zeros(len(starts), dtype=bool) if interrupt_rise is None else starts >= interrupt_rise
+
+    values = (valid.astype(np.uint8) * VALID_MASK) \
+        | (interrupt.astype(np.uint8) << PIN_INTERRUPT) \
+        | (toggle.astype(np.uint8) << PIN_SYMBOL_TOGGLE) \
+        | (carrier.astype(np.uint8) << PIN_CARRIER) \
+        | (level.astype(np.uint8) * PULSE_MASK)
+
+    durations = np.diff(np.append(starts, last_cycle)).astype(np.uint32)
+    durations, values = merge_runs(durations, values.astype(np.uint8))
+
+    return PulseSchedule(durations, values, symbol_durations, symbol_levels, interrupt_cycles, interrupt_sources, end_cycle, truncated)
@@ -0,0 +1,196 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# The configuration registers reg_0 to reg_4 of the peripheral as named fields,
+# generated from a single table that mirrors REG_0 to REG_4 in docs/info.md.
+
+from enum import IntFlag
+from typing import NamedTuple
+
+NUM_REGISTERS = 5
+REGISTER_BYTES = 4
+
+class Field(NamedTuple):
+    name: str
+    register: int # reg_0 to reg_4
+    shift: int
+    width: int
+
+FIELDS = (
+    # REG_0, the lower byte are commands, the interrupt and program status when read
+    Field("clear_timer_interrupt", 0, 0, 1),
+    Field("clear_program_loop_interrupt", 0, 1, 1),
+    Field("clear_program_end_interrupt", 0, 2, 1),
+    Field("clear_program_counter_mid_interrupt", 0, 3, 1),
+    Field("start_program", 0, 4, 1),
+    Field("stop_program", 0, 5, 1),
+    Field("timer_interrupt_en", 0, 8, 1),
+    Field("program_loop_interrupt_en", 0, 9, 1),
+    Field("program_end_interrupt_en", 0, 10, 1),
+    Field("program_counter_mid_interrupt_en", 0, 11, 1),
+    Field("loop_forever", 0, 12, 1),
+    Field("idle_level", 0, 13, 1),
+    Field("invert_output", 0, 14, 1),
+    Field("carrier_en", 0, 15, 1),
+    Field("downcount", 0, 16, 1),
+    Field("use_2bpe", 0, 17, 1),
+    Field("low_symbol_0", 0, 18, 2),
+    Field("low_symbol_1", 0, 20, 2),
+    Field("high_symbol_0", 0, 22, 2),
+    Field("high_symbol_1", 0, 24, 2),
+    # REG_1
+    Field("program_start_index", 1, 0, 8),
+    Field("program_end_index", 1, 8, 8),
+    Field("program_loopback_index", 1, 16, 8),
+    Field("program_loop_count", 1, 24, 8),
+    # REG_2
+    Field("main_low_duration_a", 2, 0, 8),
+    Field("main_low_duration_b", 2, 8, 8),
+    Field("main_high_duration_a", 2, 16, 8),
+    Field("main_high_duration_b", 2, 24, 8),
+    # REG_3
+    Field("auxillary_mask", 3, 0, 8),
+    Field("auxillary_duration_a", 3, 8, 8),
+    Field("auxillary_duration_b", 3, 16, 8),
+    Field("auxillary_prescaler", 3, 24, 4),
+    Field("main_prescaler", 3, 28, 4),
+    # REG_4
+    Field("carrier_duration", 4, 0, 11),
+)
+
+# The command bits of reg_0, they act when written and are not configuration
+COMMAND_MASK = 0xFF
+
+# The interrupt sources, as the interrupt status bits of reg_0 when read
+# and the corresponding clear_*_interrupt and *_interrupt_en bits
+class Interrupt(IntFlag):
+    TIMER = 1 << 0
+    PROGRAM_LOOP = 1 << 1
+    PROGRAM_END = 1 << 2
+    PROGRAM_COUNTER_MID = 1 << 3
+
+ALL_INTERRUPTS = Interrupt.TIMER | Interrupt.PROGRAM_LOOP | Interrupt.PROGRAM_END | Interrupt.PROGRAM_COUNTER_MID
+PROGRAM_STATUS_SHIFT = 4
+
+class InterruptStatus(NamedTuple):
+    interrupts: Interrupt # the pending interrupts
+    program_running: bool # program_status
+
+    @classmethod
+    def from_status(cls, status: int) -> "InterruptStatus":
+        # Decode the lower byte of reg_0 when read
+        return cls(Interrupt(status & ALL_INTERRUPTS), bool((status >> PROGRAM_STATUS_SHIFT) & 1))
+
+class Status(NamedTuple):
+    """
+    The 32 bit word read from any register of the peripheral.
+    program_counter and program_loop_counter may be ahead of the transmitted symbol, as the next symbol is prefetched.
+    """
+    interrupts: Interrupt # the pending interrupts
+    program_running: bool # program_status
+    program_counter: int
+    program_loop_counter: int
+
+    @classmethod
+    def from_word(cls, word: int) -> "Status":
+        interrupt_status = InterruptStatus.from_status(word & 0xFF)
+        return cls(interrupt_status.interrupts, interrupt_status.program_running, (word >> 8) & 0xFF, (word >> 16) & 0xFF)
+
+# The indices of the fields of each register
+_REGISTER_FIELDS = tuple(tuple(index for index, field in enumerate(FIELDS) if field.register == register) for register in range(NUM_REGISTERS))
+
+class RegisterImage:
+    """
+    The values of reg_0 to reg_4, as a named attribute per field of FIELDS (e.g. image.use_2bpe).
+
+    Setting a field checks that the value fits, and only clears the packed value of its register,
+    which is packed again the next time it is needed.
+    """
+    __slots__ = ("_values", "_packed")
+
+    def __init__(self, **fields: int):
+        self._values = [0] * len(FIELDS)
+        self._packed = [0] * NUM_REGISTERS
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def register(self, index: int) -> int:
+        # The packed value of reg_<index>
+        packed = self._packed[index]
+        if packed is None:
+            packed = 0
+            values = self._values
+            for field_index in _REGISTER_FIELDS[index]:
+                packed |= values[field_index] << FIELDS[field_index].shift
+            self._packed[index] = packed
+        return packed
+
+    def to_registers(self) -> tuple[int, int, int, int, int]:
+        return tuple(self.register(index) for index in range(NUM_REGISTERS))
+
+    @classmethod
+    def from_registers(cls, registers: tuple[int, int, int, int, int]) -> "RegisterImage":
+        """
+        Unpack reg_0 to reg_4, the unused bits are dropped.
+
+        Args:
+            registers (tuple[int, int, int, int, int]): The values of reg_0 to reg_4
+
+        Returns:
+            RegisterImage: The register image
+        """
+        assert len(registers) == NUM_REGISTERS
+        image = cls()
+        image._values = [(registers[field.register] >> field.shift) & ((1 << field.width) - 1) for field in FIELDS]
+        image._packed = [None] * NUM_REGISTERS
+        return image
+
+    # reg_0 to reg_4 as a single integer, reg_0 in the lowest 32 bits
+    def to_int(self) -> int:
+        value = 0
+        for index in range(NUM_REGISTERS):
+            value |= self.register(index) << (index * REGISTER_BYTES * 8)
+        return value
+
+    @classmethod
+    def from_int(cls, value: int) -> "RegisterImage":
+        return cls.from_registers(tuple((value >> (index * REGISTER_BYTES * 8)) & 0xFFFFFFFF for index in range(NUM_REGISTERS)))
+
+    # reg_0 to reg_4 as little endian bytes, in the order of their addresses
+    def to_bytes(self) -> bytes:
+        return self.to_int().to_bytes(NUM_REGISTERS * REGISTER_BYTES, "little")
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "RegisterImage":
+        assert len(data) == NUM_REGISTERS * REGISTER_BYTES
+        return cls.from_int(int.from_bytes(data, "little"))
+
+    def copy(self) -> "RegisterImage":
+        image = RegisterImage.__new__(RegisterImage)
+        image._values = self._values.copy()
+        image._packed = self._packed.copy()
+        return image
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RegisterImage) and self._values == other._values
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field.name}={value}" for field, value in zip(FIELDS, self._values) if value)
+        return f"RegisterImage({fields})"
+
+def _field_property(index: int, field: Field) -> property:
+    limit = 1 << field.width
+
+    def get(self) -> int:
+        return self._values[index]
+
+    def set(self, value: int):
+        if not 0 <= value < limit:
+            raise ValueError(f"{field.name} must be in the range 0 to {limit - 1}, not {value}")
+        self._values[index] = value
+        self._packed[field.register] = None
+
+    return property(get, set, doc=f"reg_{field.register}[{field.shift + field.width - 1}:{field.shift}]")
+
+for _index, _field in enumerate(FIELDS):
+    setattr(RegisterImage, _field.name, _field_property(_index, _field))
@@ -0,0 +1,252 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Runs the cocotb tests of test.py in parallel, split into shards.
+#
+# The simulation is compiled once by the Makefile, then every shard runs
+# its share of the tests with its own copy of SIM_BUILD, its own results file
+# and its own VCD file. The tests are assigned to the shards by their cost,
+# so that all the shards finish at about the same time, and the results of
+# the shards are merged into a single results.xml at the end.
+# With INSTRUMENT=1, the counters of the shards are merged into INSTRUMENT_JSON
+# and added to results.xml as properties of each test.
+#
+# Usage (from the test directory, make variables are passed through):
+#   python run_sharded.py -j 8
+#   python run_sharded.py -j 8 TQV_BACKEND=spi
+#   python run_sharded.py -j 8 SIM=verilator DUMP=fst
+
+import argparse
+import ast
+import heapq
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+from typing import NamedTuple
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TIME_UNITS_MS = {"fs": 1e-12, "ps": 1e-9, "ns": 1e-6, "us": 1e-3, "ms": 1, "sec": 1e3}
+
+class TestCase(NamedTuple):
+    name: str
+    timeout_ms: float | None # the timeout_time of the @cocotb.test decorator
+
+def collect_tests(module: str) -> list[TestCase]:
+    """
+    Find the cocotb tests of a module, in the order that cocotb runs them.
+
+    Args:
+        module (str): The basename of the Python test file, as MODULE of the Makefile
+
+    Returns:
+        list[TestCase]: The tests
+    """
+    with open(os.path.join(TEST_DIR, module + ".py")) as f:
+        tree = ast.parse(f.read())
+
+    tests = []
+    for node in tree.body:
+        if not isinstance(node, ast.AsyncFunctionDef):
+            continue
+        for decorator in node.decorator_list:
+            call = decorator if isinstance(decorator, ast.Call) else None
+            target = call.func if call else decorator
+            if ast.unparse(target) != "cocotb.test":
+                continue
+            keywords = {keyword.arg: keyword.value for keyword in call.keywords} if call else {}
+            timeout_ms = None
+            if isinstance(keywords.get("timeout_time"), ast.Constant):
+                unit = keywords["timeout_unit"].value if isinstance(keywords.get("timeout_unit"), ast.Constant) else "step"
+                if unit in TIME_UNITS_MS:
+                    timeout_ms = keywords["timeout_time"].value * TIME_UNITS_MS[unit]
+            tests.append(TestCase(node.name, timeout_ms))
+    return tests
+
+def read_history(path: str) -> dict[str, float]:
+    # The wall time in seconds of each test in a previous results.xml
+    if not os.path.exists(path):
+        return {}
+    history = {}
+    for testcase in ET.parse(path).iter("testcase"):
+        if testcase.find("skipped") is None and "time" in testcase.attrib:
+            history[testcase.get("name")] = float(testcase.get("time"))
+    return history
+
+def estimate_costs(tests: list[TestCase], history: dict[str, float]) -> dict[str, float]:
+    """
+    The expected wall time of each test, from its time in a previous run.
+    Tests without a previous time are predicted from their timeout,
+    scaled by the wall time per timeout of the tests that have one.
+
+    Args:
+        tests (list[TestCase]): The tests
+        history (dict[str, float]): The wall time in seconds of previously run tests
+
+    Returns:
+        dict[str, float]: The cost of each test
+    """
+    timed = [test for test in tests if test.name in history and test.timeout_ms]
+    timeout_total = sum(test.timeout_ms for test in timed)
+    seconds_per_ms = sum(history[test.name] for test in timed) / timeout_total if timeout_total else 1.0
+
+    # Tests without a timeout are assumed to be as long as the average one
+    timeouts = [test.timeout_ms for test in tests if test.timeout_ms]
+    default_timeout_ms = sum(timeouts) / len(timeouts) if timeouts else 1.0
+
+    costs = {}
+    for test in tests:
+        if test.name in history:
+            costs[test.name] = history[test.name]
+        else:
+            costs[test.name] = (test.timeout_ms or default_timeout_ms) * seconds_per_ms
+    return costs
+
+def pack_shards(tests: list[TestCase], costs: dict[str, float], num_shards: int) -> list[list[TestCase]]:
+    """
+    Split the tests into shards of about the same total cost.
+    The most expensive tests are placed first, each into the cheapest shard so far.
+
+    Args:
+        tests (list[TestCase]): The tests
+        costs (dict[str, float]): The cost of each test
+        num_shards (int): The maximum number of shards
+
+    Returns:
+        list[list[TestCase]]: The non-empty shards, each in the original order of the tests
+    """
+    shards = [[] for _ in range(num_shards)]
+    heap = [(0.0, index) for index in range(num_shards)]
+    for test in sorted(tests, key=lambda test: costs[test.name], reverse=True):
+        load, index = heapq.heappop(heap)
+        shards[index].append(test)
+        heapq.heappush(heap, (load + costs[test.name], index))
+
+    order = {test.name: position for position, test in enumerate(tests)}
+    return [sorted(shard, key=lambda test: order[test.name]) for shard in shards if shard]
+
+def merge_counters(shard_counters: list[str], output: str) -> dict[str, dict[str, int]]:
+    # Merges the INSTRUMENT_JSON of the shards, the shards run different tests
+    counters = {}
+    for path in shard_counters:
+        if os.path.exists(path):
+            with open(path) as f:
+                counters.update(json.load(f))
+    with open(output, "w") as f:
+        json.dump(counters, f, indent=2, sort_keys=True)
+    return counters
+
+def merge_results(tests: list[TestCase], shard_results: list[str], output: str, counters: dict[str, dict[str, int]] = None):
+    """
+    Merge the results files of the shards into one, with the tests in their original order.
+    A test that is missing from its shard, e.g. because the simulator crashed, is reported as a failure.
+
+    Args:
+        tests (list[TestCase]): All the tests that were run
+        shard_results (list[str]): The results file of each shard
+        output (str): The merged results file
+        counters (dict[str, dict[str, int]]): The counters of each test, added as its properties
+    """
+    root = ET.Element("testsuites", name="results")
+    suite = ET.SubElement(root, "testsuite", name="all", package="all")
+
+    testcases = {}
+    for index, path in enumerate(shard_results):
+        if not os.path.exists(path):
+            continue
+        for shard_suite in ET.parse(path).iter("testsuite"):
+            for shard_property in shard_suite.iter("property"):
+                ET.SubElement(suite, "property", name=f'shard{index}_{shard_property.get("name")}', value=shard_property.get("value"))
+            for testcase in shard_suite.iter("testcase"):
+                testcases[testcase.get("name")] = testcase
+
+    for test in tests:
+        testcase = testcases.get(test.name)
+        if testcase is None:
+            testcase = ET.Element("testcase", name=test.name, classname="test")
+            ET.SubElement(testcase, "failure", message="Test did not report a result, see the log of its shard")
+        if counters and test.name in counters:
+            properties = ET.Element("properties")
+            for name, value in sorted(counters[test.name].items()):
+                ET.SubElement(properties, "property", name=name, value=str(value))
+            testcase.insert(0, properties)
+        suite.append(testcase)
+
+    ET.indent(root)
+    ET.ElementTree(root).write(output)
+
+def make(args: list[str], **kwargs) -> subprocess.CompletedProcess:
+    # $(PWD) of the Makefile must be the test directory
+    env = dict(os.environ, PWD=TEST_DIR)
+    env.update(kwargs.pop("env", {}))
+    return subprocess.run(["make", *args], cwd=TEST_DIR, env=env, **kwargs)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the cocotb tests in parallel shards and merge their results.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of shards to run in parallel (default: number of CPUs)")
+    parser.add_argument("--module", default="test", help="Python test module (default: test)")
+    parser.add_argument("--history", default="results.xml", help="previous results, to balance the shards (default: results.xml)")
+    parser.add_argument("--output", default="results.xml", help="merged results file (default: results.xml)")
+    parser.add_argument("make_args", nargs="*", help="make variables, e.g. TQV_BACKEND=spi")
+    args = parser.parse_args()
+
+    tests = collect_tests(args.module)
+    costs = estimate_costs(tests, read_history(os.path.join(TEST_DIR, args.history)))
+    shards = pack_shards(tests, costs, max(1, args.jobs))
+    make_args = [f"MODULE={args.module}", *args.make_args]
+    make_vars = dict(arg.split("=", 1) for arg in make_args if "=" in arg)
+    dump = make_vars.get("DUMP", os.environ.get("DUMP", "off"))
+    instrument = make_vars.get("INSTRUMENT", os.environ.get("INSTRUMENT")) == "1"
+    instrument_json = make_vars.get("INSTRUMENT_JSON", os.environ.get("INSTRUMENT_JSON", "counters.json"))
+
+    # Compile once, into the SIM_BUILD that a plain make would use
+    sim_build = make(["-s", "print-sim-build", *make_args], capture_output=True, text=True, check=True).stdout.strip()
+    if make(["compile", *make_args]).returncode != 0:
+        sys.exit("Compilation failed")
+
+    print(f"Running {len(tests)} tests in {len(shards)} shards")
+    processes = []
+    shard_results = []
+    shard_counters = []
+    for index, shard in enumerate(shards):
+        shard_build = f"{sim_build}_shard{index}"
+        shard_path = os.path.join(TEST_DIR, shard_build)
+        # copytree keeps the modification times, so make does not compile again
+        shutil.rmtree(shard_path, ignore_errors=True)
+        shutil.copytree(os.path.join(TEST_DIR, sim_build), shard_path, symlinks=True)
+
+        results = os.path.join(shard_path, "results.xml")
+        shard_results.append(results)
+        counters = os.path.join(shard_path, "counters.json")
+        shard_counters.append(counters)
+        log = open(os.path.join(shard_path, "sim.log"), "w")
+        process = subprocess.Popen(
+            ["make", f"SIM_BUILD={shard_build}", f'TESTCASE={",".join(test.name for test in shard)}', f"COCOTB_RESULTS_FILE={results}",
+             f'DUMP_FILE={os.path.join(shard_path, "tb." + dump)}', *make_args, f"INSTRUMENT_JSON={counters}"],
+            cwd=TEST_DIR, env=dict(os.environ, PWD=TEST_DIR), stdout=log, stderr=subprocess.STDOUT)
+        processes.append((process, log, time.monotonic()))
+        print(f"  shard {index}: {len(shard)} tests, estimated {sum(costs[test.name] for test in shard):.1f}, log in {shard_build}/sim.log")
+
+    for index, (process, log, start) in enumerate(processes):
+        process.wait()
+        log.close()
+        print(f"  shard {index} finished in {time.monotonic() - start:.1f} s with exit code {process.returncode}")
+
+    output = os.path.join(TEST_DIR, args.output)
+    counters = merge_counters(shard_counters, os.path.join(TEST_DIR, instrument_json)) if instrument else None
+    merge_results(tests, shard_results, output, counters)
+
+    testcases = list(ET.parse(output).iter("testcase"))
+    failed = [testcase.get("name") for testcase in testcases if testcase.find("failure") is not None or testcase.find("error") is not None]
+    skipped = sum(testcase.find("skipped") is not None for testcase in testcases)
+    print(f"TESTS={len(testcases)} PASS={len(testcases) - len(failed) - skipped} FAIL={len(failed)} SKIP={skipped}")
+    for name in failed:
+        print(f"  FAIL {name}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
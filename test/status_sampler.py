@@ -0,0 +1,115 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Samples the status word of the peripheral (as read from any of its registers)
+# at a fixed rate into preallocated NumPy arrays, to follow the progress of a program,
+# e.g. how far program_counter runs ahead of the transmitted symbol.
+
+import cocotb
+from cocotb.triggers import Event, ReadOnly, RisingEdge, Timer
+from cocotb.utils import get_sim_time
+
+import numpy as np
+
+from register_image import ALL_INTERRUPTS, PROGRAM_STATUS_SHIFT
+
+class StatusSampler:
+    """
+    Background sampler of the status word, recording (sim time, program_counter, program_loop_counter)
+    and the interrupt and program status bits every `period` ps, aligned to the rising edges of clk.
+
+    The status word is either peeked from `signal` (the data_out of the peripheral, which does
+    not depend on the address) without any bus transaction, or read with the coroutine function `read`,
+    in which case nothing else may access the registers while the sampler is running,
+    and a sample may take longer than the period.
+
+    Nothing is sampled, and the sampler does not wake up, until start() is called.
+    With ring=True, only the last `capacity` samples are kept, otherwise the arrays grow as needed.
+    """
+    def __init__(self, clk, period: int, signal=None, read=None, capacity: int = 1 << 14, ring: bool = False):
+        assert (signal is None) != (read is None), "either signal or read must be given"
+        self.clk = clk
+        self.period = period
+        self.signal = signal
+        self.read = read
+        self.ring = ring
+        self.times = np.zeros(capacity, dtype=np.int64)   # ps
+        self.program_counters = np.zeros(capacity, dtype=np.uint8)
+        self.loop_counters = np.zeros(capacity, dtype=np.uint8)
+        self.statuses = np.zeros(capacity, dtype=np.uint8) # the interrupt status and program_status bits
+        self.count = 0 # total number of samples, may be more than the capacity in ring mode
+        self._running = False
+        self._wake = Event()
+        self._idle = Event()
+        self._task = cocotb.start_soon(self._monitor())
+
+    # Starts a new sampling window, from the next rising edge of clk
+    def start(self):
+        self.count = 0
+        self._running = True
+        self._idle.clear()
+        self._wake.set()
+
+    def stop(self):
+        self._running = False
+
+    # Waits until the sampler has stopped, i.e. until the read in progress has completed
+    async def wait_stopped(self):
+        await self._idle.wait()
+
+    def kill(self):
+        self._task.kill()
+
+    def _record(self, time: int, word: int):
+        capacity = len(self.times)
+        if self.count == capacity and not self.ring:
+            self.times = np.resize(self.times, capacity * 2)
+            self.program_counters = np.resize(self.program_counters, capacity * 2)
+            self.loop_counters = np.resize(self.loop_counters, capacity * 2)
+            self.statuses = np.resize(self.statuses, capacity * 2)
+            capacity *= 2
+        index = self.count % capacity
+        self.times[index] = time
+        self.program_counters[index] = (word >> 8) & 0xFF
+        self.loop_counters[index] = (word >> 16) & 0xFF
+        self.statuses[index] = word & (ALL_INTERRUPTS | 1 << PROGRAM_STATUS_SHIFT)
+        self.count += 1
+
+    async def _monitor(self):
+        edge = RisingEdge(self.clk)
+        read_only = ReadOnly()
+        while True:
+            if not self._running:
+                self._idle.set()
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            # A single Timer per sample, from a rising edge, instead of waking up on every clock edge
+            await edge
+            timer = Timer(self.period, "ps")
+            while self._running:
+                if self.signal is not None:
+                    await read_only
+                    self._record(int(get_sim_time("ps")), int(self.signal.value))
+                    await timer
+                else:
+                    time = int(get_sim_time("ps"))
+                    self._record(time, await self.read())
+                    # The read may be longer than the period, the next one starts on a clock edge
+                    remaining = self.period - (int(get_sim_time("ps")) - time)
+                    await (Timer(remaining, "ps") if remaining > 0 else edge)
+
+    # The samples in order, the oldest ones may have been dropped in ring mode
+    def samples(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: The time in ps, program_counter,
+                program_loop_counter and the interrupt and program status bits of each sample
+        """
+        arrays = (self.times, self.program_counters, self.loop_counters, self.statuses)
+        capacity = len(self.times)
+        if self.count <= capacity:
+            return tuple(array[:self.count] for array in arrays)
+        first = self.count % capacity
+        return tuple(np.roll(array, -first) for array in arrays)
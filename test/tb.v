@@ -6,13 +6,34 @@
 */
 module tb ();
 
-  // Dump the signals to a VCD file. You can view it with gtkwave or surfer.
+  // Dump the signals to a VCD or FST file with +dumpvars, see DUMP in the Makefile.
+  // You can view it with gtkwave or surfer.
+  // +dumpfile=<path> sets the file, see DUMP_FILE in the Makefile.
+  // test.py clears dump_enable to pause the dump outside of the selected tests.
+`ifndef DUMP_SCOPE
+`define DUMP_SCOPE tb
+`endif
+  reg [8*256-1:0] dumpfile;
+  reg dumping = 0;
+  reg dump_enable = 1;
   initial begin
-    $dumpfile("tb.vcd");
-    $dumpvars(0, tb);
+    if ($test$plusargs("dumpvars")) begin
+      if (!$value$plusargs("dumpfile=%s", dumpfile)) dumpfile = "tb.vcd";
+      $dumpfile(dumpfile);
+      $dumpvars(0, `DUMP_SCOPE);
+      dumping = 1;
+      if (!dump_enable) $dumpoff;
+    end
     #1;
   end
 
+  always @(dump_enable) begin
+    if (dumping) begin
+      if (dump_enable) $dumpon;
+      else $dumpoff;
+    end
+  end
+
   // Wire up the inputs and outputs:
   reg clk;
   reg rst_n;
@@ -22,6 +43,14 @@ module tb ();
   wire [7:0] uo_out;
   wire [7:0] uio_out;
   wire [7:0] uio_oe;
+
+  // Single uo_out pins, so that the test can wait for the edges of one of them
+  // without also waking up on the others (e.g. the carrier)
+  wire valid_out = uo_out[0];
+  wire interrupt_out = uo_out[2];
+  wire symbol_toggle_out = uo_out[3];
+  wire carrier_out = uo_out[4];
+  wire pulse_out = uo_out[5];
 `ifdef GL_TEST
   wire VPWR = 1'b1;
   wire VGND = 1'b0;
@@ -0,0 +1,98 @@
+`default_nettype none
+`timescale 1ns / 1ps
+
+/* This testbench instantiates the peripheral without the SPI test harness.
+   The cocotb test drives the TinyQV peripheral bus (address, data_in,
+   data_write_n, data_read_n) directly, one transaction per clock,
+   see tqv_bus.py. The remaining wires match tb.v so that test.py
+   runs unchanged against either testbench.
+*/
+module tb_bfm ();
+
+  // Dump the signals to a VCD or FST file with +dumpvars, see DUMP in the Makefile.
+  // You can view it with gtkwave or surfer.
+  // +dumpfile=<path> sets the file, see DUMP_FILE in the Makefile.
+  // test.py clears dump_enable to pause the dump outside of the selected tests.
+`ifndef DUMP_SCOPE
+`define DUMP_SCOPE tb_bfm
+`endif
+  reg [8*256-1:0] dumpfile;
+  reg dumping = 0;
+  reg dump_enable = 1;
+  initial begin
+    if ($test$plusargs("dumpvars")) begin
+      if (!$value$plusargs("dumpfile=%s", dumpfile)) dumpfile = "tb.vcd";
+      $dumpfile(dumpfile);
+      $dumpvars(0, `DUMP_SCOPE);
+      dumping = 1;
+      if (!dump_enable) $dumpoff;
+    end
+    #1;
+  end
+
+  always @(dump_enable) begin
+    if (dumping) begin
+      if (dump_enable) $dumpon;
+      else $dumpoff;
+    end
+  end
+
+  // Wire up the inputs and outputs:
+  reg clk;
+  reg rst_n;
+  reg ena;
+  reg [7:0] ui_in;
+  reg [7:0] uio_in;
+  wire [7:0] uo_out;
+  wire [7:0] uio_out;
+  wire [7:0] uio_oe;
+
+  // Single uo_out pins, so that the test can wait for the edges of one of them
+  // without also waking up on the others (e.g. the carrier)
+  wire valid_out = uo_out[0];
+  wire interrupt_out = uo_out[2];
+  wire symbol_toggle_out = uo_out[3];
+  wire carrier_out = uo_out[4];
+  wire pulse_out = uo_out[5];
+
+  // The peripheral bus, driven by the cocotb test
+  reg [5:0] address;
+  reg [31:0] data_in;
+  reg [1:0] data_write_n;
+  reg [1:0] data_read_n;
+  wire [31:0] data_out;
+  wire data_ready;
+  wire user_interrupt;
+
+  // Peripherals get synchronized ui_in.
+  wire [7:0] ui_in_sync;
+  synchronizer #(.STAGES(2), .WIDTH(8)) synchronizer_ui_in_inst (.clk(clk), .data_in(ui_in), .data_out(ui_in_sync));
+
+  // Register reset as in TinyQV
+  reg rst_reg_n;
+  always @(negedge clk) rst_reg_n <= rst_n;
+
+  tqvp_hx2003_pulse_transmitter user_peripheral(
+    .clk(clk),
+    .rst_n(rst_reg_n),
+    .ui_in(ui_in_sync),
+    .uo_out(uo_out),
+    .address(address),
+    .data_in(data_in),
+    .data_write_n(data_write_n),
+    .data_read_n(data_read_n),
+    .data_out(data_out),
+    .data_ready(data_ready),
+    .user_interrupt(user_interrupt)
+  );
+
+  // Same pins as the SPI test harness, the SPI pins are unused
+  assign uio_out[0] = user_interrupt;
+  assign uio_out[1] = data_ready;
+  assign uio_out[7:2] = 0;
+  assign uio_oe = 8'b00001011;
+
+  // Ignore unused inputs
+  wire _unused = &{ena, uio_in, 1'b0};
+
+endmodule
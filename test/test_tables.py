@@ -0,0 +1,125 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Tests of the pure Python helpers that do not need the simulator, run with:
+#   python -m pytest test_tables.py
+
+import random
+
+import numpy as np
+import pytest
+
+import ir_protocols
+import pulse_model
+from register_image import RegisterImage
+import timing_index
+
+# Decodes the marks and spaces of the reference model for a compiled IR command, as a receiver would,
+# with a tolerance of 2 %. Returns the address, command and toggle bit
+def _decode_ir(protocol: str, program: ir_protocols.IrProgram, clock_hz: int) -> tuple[int, int, int]:
+    schedule = pulse_model.simulate(program.registers, program.words)
+    durations, levels = pulse_model.merge_runs(schedule.symbol_durations, schedule.symbol_levels)
+    runs = [(level, duration * 1e6 / clock_hz) for level, duration in zip(levels.tolist(), durations.tolist())]
+    near = lambda run, level, us: run[0] == level and abs(run[1] - us) <= us * 0.02
+    spec = ir_protocols.PROTOCOLS[protocol]
+    assert abs(sum(us for _, us in runs) - spec.frame_period_us) <= spec.frame_period_us * 0.02
+
+    if protocol.startswith("nec"):
+        assert near(runs[0], 1, 9000) and near(runs[1], 0, 4500)
+        bits = []
+        for mark, space in zip(runs[2:66:2], runs[3:67:2]):
+            assert near(mark, 1, 562.5) and (near(space, 0, 562.5) or near(space, 0, 1687.5))
+            bits.append(int(space[1] > 1125))
+        assert near(runs[66], 1, 562.5) and runs[67][0] == 0
+        value = sum(bit << index for index, bit in enumerate(bits))
+        address, command, inverted_command = value & 0xFFFF, (value >> 16) & 0xFF, value >> 24
+        assert inverted_command == ~command & 0xFF
+        if protocol == "nec":
+            assert address >> 8 == ~address & 0xFF
+            address &= 0xFF
+        return address, command, 0
+
+    if protocol == "rc5":
+        halves = []
+        for level, us in runs:
+            halves += [level] * round(us / 889)
+        bits = []
+        for first, second in zip(halves[0:28:2], halves[1:28:2]):
+            assert first != second
+            bits.append(second)
+        value = sum(bit << index for index, bit in enumerate(reversed(bits)))
+        assert value >> 13 == 1
+        command = (value & 0x3F) | (((value >> 12) & 1) ^ 1) << 6
+        return (value >> 6) & 0x1F, command, (value >> 11) & 1
+
+    # sirc
+    assert near(runs[0], 1, 2400) and near(runs[1], 0, 600)
+    marks = runs[2::2]
+    bits = []
+    for mark in marks[:spec.command_bits + spec.address_bits]:
+        assert near(mark, 1, 600) or near(mark, 1, 1200)
+        bits.append(int(mark[1] > 900))
+    value = sum(bit << index for index, bit in enumerate(bits))
+    return value >> 7, value & 0x7F, 0
+
+# Compile commands of every IR protocol and decode them from the reference model
+@pytest.mark.parametrize("protocol", list(ir_protocols.PROTOCOLS))
+def test_ir_protocol_decode(protocol):
+    clock_hz = 64_000_000
+    spec = ir_protocols.PROTOCOLS[protocol]
+    rng = random.Random(2121)
+    for _ in range(8):
+        address = rng.getrandbits(spec.address_bits)
+        command = rng.getrandbits(spec.command_bits)
+        toggle = rng.randint(0, 1) if protocol == "rc5" else 0
+        program = ir_protocols.compile_command(protocol, address, command, clock_hz=clock_hz, toggle=toggle)
+        assert _decode_ir(protocol, program, clock_hz) == (address, command, toggle)
+
+# The NEC example of docs/info.md, the carrier is toggled every carrier_duration + 1 cycles
+def test_ir_protocol_nec_example():
+    program = ir_protocols.compile_command("nec", 36, 88)
+    registers = RegisterImage.from_registers(program.registers)
+    assert sorted((registers.auxillary_duration_a, registers.auxillary_duration_b)) == [68, 139] and registers.auxillary_prescaler == 12
+    assert (registers.main_low_duration_a, registers.main_low_duration_b, registers.main_prescaler) == (68, 209, 9)
+    assert registers.carrier_duration == 841
+
+    # Compiled commands are cached
+    assert ir_protocols.compile_command("nec", 36, 88) is program
+    # The address of nec is 8 bits
+    with pytest.raises(ValueError):
+        ir_protocols.compile_command("nec", 256, 0)
+
+# The durations and carriers of the examples of docs/info.md, for both clock frequencies
+@pytest.mark.parametrize("clock_hz, main, auxillary, carrier", [
+    (timing_index.CLOCK_21MHZ, (8, [44, 136]), (10, [183, 90]), 275),
+    (timing_index.CLOCK_64MHZ, (9, [68, 209]), (12, [139, 68]), 841),
+])
+def test_timing_index_nec_example(clock_hz, main, auxillary, carrier):
+    # 563 us and 1687 us on the main durations, 9 ms and 4.5 ms on the auxillary ones
+    prescaler, matches = timing_index.nearest_durations([timing_index.ticks(ns, clock_hz) for ns in (563e3, 1687e3)])
+    assert (prescaler, [match.duration for match in matches]) == main
+    prescaler, matches = timing_index.nearest_durations([timing_index.ticks(ns, clock_hz) for ns in (9e6, 4.5e6)])
+    assert (prescaler, [match.duration for match in matches]) == auxillary
+    # docs/info.md subtracts 2 rather than 1, the carrier toggles every carrier_duration + 1 ticks
+    assert timing_index.nearest_carrier(38_000, clock_hz, max_error=0.01).carrier_duration == carrier
+
+@pytest.mark.parametrize("clock_hz, durations", [(timing_index.CLOCK_21MHZ, [5, 16]), (timing_index.CLOCK_64MHZ, [20, 52])])
+def test_timing_index_ws2812_example(clock_hz, durations):
+    # 350 ns and 850 ns without prescaler
+    assert [timing_index.nearest_duration(timing_index.ticks(ns, clock_hz), prescaler=0).duration for ns in (350, 850)] == durations
+
+# The binary searches against all durations
+def test_timing_index_nearest():
+    all_ticks = np.array([[(duration + 2) << prescaler for duration in range(256)] for prescaler in range(16)])
+    rng = np.random.default_rng(2525)
+    for target in rng.uniform(1, all_ticks.max() * 1.1, 1000).tolist():
+        match = timing_index.nearest_duration(target)
+        assert match.ticks == (match.duration + 2) << match.prescaler
+        assert abs(match.ticks - target) == np.abs(all_ticks - target).min()
+        prescaler = int(rng.integers(16))
+        match = timing_index.nearest_duration(target, prescaler)
+        assert match.prescaler == prescaler and abs(match.ticks - target) == np.abs(all_ticks[prescaler] - target).min()
+
+    # 100 ticks and 100000 ticks can not share a prescaler within 1 %
+    with pytest.raises(ValueError):
+        timing_index.nearest_durations([100, 100_000], max_error=0.01)
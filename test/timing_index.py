@@ -0,0 +1,137 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Sorted tables of every duration the peripheral can time, for looking up the register values
+# of a duration or a carrier frequency by binary search instead of working them out by hand
+# as in the examples of docs/info.md:
+#   a symbol lasts (duration + 2) << prescaler ticks, duration 0 to 255 and prescaler 0 to 15
+#   a carrier period lasts 2 * (carrier_duration + 1) ticks, carrier_duration 0 to 2047
+# A tick is a clock cycle, ticks() converts from ns for a clock frequency, e.g. CLOCK_21MHZ or CLOCK_64MHZ.
+
+from bisect import bisect_left
+from typing import NamedTuple
+
+MAX_DURATION = 255
+MAX_PRESCALER = 15
+MAX_CARRIER_DURATION = (1 << 11) - 1
+
+CLOCK_21MHZ = 21_000_000
+CLOCK_64MHZ = 64_000_000
+
+class DurationMatch(NamedTuple):
+    duration: int
+    prescaler: int
+    ticks: int # (duration + 2) << prescaler
+    error: float # relative to the target
+
+class CarrierMatch(NamedTuple):
+    carrier_duration: int
+    period_ticks: int # 2 * (carrier_duration + 1)
+    error: float # of the frequency, relative to the target
+
+# All (ticks, prescaler, duration), sorted so that equal ticks come with the finest prescaler first
+_INDEX = sorted(((duration + 2) << prescaler, prescaler, duration)
+    for prescaler in range(MAX_PRESCALER + 1) for duration in range(MAX_DURATION + 1))
+TICKS = [entry[0] for entry in _INDEX]
+# The ticks of each duration, per prescaler
+PRESCALER_TICKS = [[(duration + 2) << prescaler for duration in range(MAX_DURATION + 1)] for prescaler in range(MAX_PRESCALER + 1)]
+# The longest duration of each prescaler
+MAX_TICKS = [ticks[-1] for ticks in PRESCALER_TICKS]
+CARRIER_PERIOD_TICKS = [2 * (carrier_duration + 1) for carrier_duration in range(MAX_CARRIER_DURATION + 1)]
+
+def ticks(ns: float, clock_hz: int) -> float:
+    # The clock cycles in ns
+    return ns * clock_hz / 1e9
+
+def _nearest(table: list[int], target: float) -> int:
+    # The index of the entry of a sorted table nearest to target, the first of equal entries
+    index = bisect_left(table, target)
+    if index == len(table):
+        return index - 1
+    if index and target - table[index - 1] <= table[index] - target:
+        return bisect_left(table, table[index - 1])
+    return index
+
+def _match(target: float, prescaler: int, duration: int) -> DurationMatch:
+    value = (duration + 2) << prescaler
+    return DurationMatch(duration, prescaler, value, abs(value - target) / target)
+
+def _check(matches: list[DurationMatch], max_error: float):
+    if max_error is None:
+        return
+    for match in matches:
+        if match.error > max_error:
+            raise ValueError(f"The nearest duration is {match.ticks} ticks, off by more than {max_error:.1%}")
+
+def nearest_duration(target: float, prescaler: int = None, max_error: float = None) -> DurationMatch:
+    """
+    The duration and prescaler nearest to a number of ticks, the finest prescaler on a tie.
+
+    Args:
+        target (float): The ticks, see ticks()
+        prescaler (int): Only consider this prescaler, e.g. when it is shared with other durations
+        max_error (float): Raise a ValueError if the relative error is more than this, None to not check
+
+    Returns:
+        DurationMatch: The register values and the ticks they give
+    """
+    if target <= 0:
+        raise ValueError(f"The target must be positive, not {target}")
+    if prescaler is None:
+        _, prescaler, duration = _INDEX[_nearest(TICKS, target)]
+    else:
+        duration = _nearest(PRESCALER_TICKS[prescaler], target)
+    match = _match(target, prescaler, duration)
+    _check([match], max_error)
+    return match
+
+def nearest_durations(targets: list[float], max_error: float = None) -> tuple[int, list[DurationMatch]]:
+    """
+    The durations nearest to several numbers of ticks that share a prescaler,
+    e.g. the 4 main durations, or the 2 auxillary durations.
+
+    The finest prescaler that fits the longest target rounds every target best, unless the target
+    is just beyond the previous prescaler, so those 2 are tried and the one with the smallest
+    worst relative error is taken.
+
+    Args:
+        targets (list[float]): The ticks, see ticks()
+        max_error (float): Raise a ValueError if any relative error is more than this, None to not check
+
+    Returns:
+        tuple[int, list[DurationMatch]]: The prescaler, and the match of each target
+    """
+    if not targets or min(targets) <= 0:
+        raise ValueError(f"The targets must be positive, not {targets}")
+    finest = min(bisect_left(MAX_TICKS, max(targets)), MAX_PRESCALER)
+    best = None
+    for prescaler in range(max(finest - 1, 0), finest + 1):
+        table = PRESCALER_TICKS[prescaler]
+        matches = [_match(target, prescaler, _nearest(table, target)) for target in targets]
+        worst = max(match.error for match in matches)
+        if best is None or worst < best[0]:
+            best = (worst, prescaler, matches)
+    _, prescaler, matches = best
+    _check(matches, max_error)
+    return prescaler, matches
+
+def nearest_carrier(frequency_hz: float, clock_hz: int, max_error: float = None) -> CarrierMatch:
+    """
+    The carrier_duration nearest to a carrier frequency.
+
+    Args:
+        frequency_hz (float): The carrier frequency
+        clock_hz (int): The clock frequency of the peripheral
+        max_error (float): Raise a ValueError if the relative error of the frequency is more than this, None to not check
+
+    Returns:
+        CarrierMatch: The register value and the period it gives
+    """
+    if frequency_hz <= 0:
+        raise ValueError(f"The carrier frequency must be positive, not {frequency_hz}")
+    carrier_duration = _nearest(CARRIER_PERIOD_TICKS, clock_hz / frequency_hz)
+    period_ticks = CARRIER_PERIOD_TICKS[carrier_duration]
+    error = abs(clock_hz / period_ticks - frequency_hz) / frequency_hz
+    if max_error is not None and error > max_error:
+        raise ValueError(f"The nearest carrier is {clock_hz / period_ticks:.0f} Hz, off by more than {max_error:.1%}")
+    return CarrierMatch(carrier_duration, period_ticks, error)
@@ -1,10 +1,15 @@
 # SPDX-FileCopyrightText: © 2025 Michael Bell
 # SPDX-License-Identifier: Apache-2.0
 
+from collections import Counter
+
 from cocotb.triggers import ClockCycles
 
 from tqv_reg import spi_write_cpha0, spi_read_cpha0
 
+# Command, width, padding and address, then the data
+SPI_FRAME_BITS = 32 + 32
+
 # This class provides access to the peripheral's registers.
 # This implementation uses the SPI interface embedded in this project,
 # but when the peripheral is added to TinyQV a different implementation
@@ -13,6 +18,12 @@ from tqv_reg import spi_write_cpha0, spi_read_cpha0
 class TinyQV:
     def __init__(self, dut, peripheral_num):
         self.dut = dut
+        # Transactions by direction, width and register (e.g. write32_reg4) and SPI bits shifted
+        self.counters = Counter()
+
+    def _count(self, direction, width, reg):
+        self.counters[f"{direction}{8 << width}_reg{reg}"] += 1
+        self.counters["spi_bits"] += SPI_FRAME_BITS
 
     # Reset the design, this reset will initialize TinyQV and connect
     # all inputs and outputs to your peripheral.
@@ -30,36 +41,42 @@ class TinyQV:
     # reg is the address of the register in the range 0-15
     # value is the value to be written, in the range 0-255
     async def write_byte_reg(self, reg, value):
+        self._count("write", 0, reg)
         await spi_write_cpha0(self.dut.clk, self.dut.uio_in, reg, value, 0)
 
     # Read the value of a byte register from your design
     # reg is the address of the register in the range 0-15
     # The returned value is the data read from the register, in the range 0-255
     async def read_byte_reg(self, reg):
+        self._count("read", 0, reg)
         return await spi_read_cpha0(self.dut.clk, self.dut.uio_in, self.dut.uio_out, self.dut.uio_out[1], reg, 0, 0)
 
     # Write a value to a half word register in your design
     # reg is the address of the register in the range 0-15
     # value is the value to be written, in the range 0-65535
     async def write_hword_reg(self, reg, value):
+        self._count("write", 1, reg)
         await spi_write_cpha0(self.dut.clk, self.dut.uio_in, reg, value, 1)
 
     # Read the value of a half word register from your design
     # reg is the address of the register in the range 0-15
     # The returned value is the data read from the register, in the range 0-65535
     async def read_hword_reg(self, reg):
+        self._count("read", 1, reg)
         return await spi_read_cpha0(self.dut.clk, self.dut.uio_in, self.dut.uio_out, self.dut.uio_out[1], reg, 0, 1)
 
     # Write a value to a word register in your design
     # reg is the address of the register in the range 0-15
     # value is the value to be written
     async def write_word_reg(self, reg, value):
+        self._count("write", 2, reg)
         await spi_write_cpha0(self.dut.clk, self.dut.uio_in, reg, value, 2)
 
     # Read the value of a word register from your design
     # reg is the address of the register in the range 0-15
     # The returned value is the data read from the register
     async def read_word_reg(self, reg):
+        self._count("read", 2, reg)
         return await spi_read_cpha0(self.dut.clk, self.dut.uio_in, self.dut.uio_out, self.dut.uio_out[1], reg, 0, 2)
     
     # Check whether the user interrupt is asserted
@@ -0,0 +1,123 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import Counter
+
+from cocotb.triggers import ClockCycles, RisingEdge, FallingEdge, ReadOnly
+
+# Transaction widths, as encoded on data_write_n / data_read_n
+BUS_WIDTH_BYTE = 0b00
+BUS_WIDTH_HWORD = 0b01
+BUS_WIDTH_WORD = 0b10
+BUS_IDLE = 0b11
+
+BUS_WIDTH_BITS = {
+    BUS_WIDTH_BYTE: 8,
+    BUS_WIDTH_HWORD: 16,
+    BUS_WIDTH_WORD: 32,
+}
+
+BUS_WIDTH_MASK = {
+    BUS_WIDTH_BYTE: 0xFF,
+    BUS_WIDTH_HWORD: 0xFFFF,
+    BUS_WIDTH_WORD: 0xFFFFFFFF,
+}
+
+# This class provides access to the peripheral's registers, with the same
+# interface as the TinyQV class in tqv.py.
+# Instead of going through the SPI test harness, it drives the peripheral bus
+# of the tb_bfm toplevel directly, one transaction per clock, like the
+# TinyQV core does.
+class TinyQVBus:
+    def __init__(self, dut, peripheral_num):
+        self.dut = dut
+        self.clk_edge = RisingEdge(dut.clk)
+        self.clk_falling_edge = FallingEdge(dut.clk)
+        # Transactions by direction, width and register (e.g. write32_reg4), as in TinyQV
+        self.counters = Counter()
+
+    # Reset the design, the bus is idle during and after the reset
+    async def reset(self):
+        self.dut._log.info("Reset")
+        self.dut.ena.value = 1
+        self.dut.ui_in.value = 0
+        self.dut.uio_in.value = 0
+        self.dut.address.value = 0
+        self.dut.data_in.value = 0
+        self.dut.data_write_n.value = BUS_IDLE
+        self.dut.data_read_n.value = BUS_IDLE
+        self.dut.rst_n.value = 0
+        await ClockCycles(self.dut.clk, 10)
+        self.dut.rst_n.value = 1
+        assert self.dut.uio_oe.value == 0b00001011
+
+    # The transaction is taken by the peripheral on the rising edge, return
+    # half a cycle later so that its effect is visible to the caller
+    async def _end_transaction(self):
+        self.dut.data_write_n.value = BUS_IDLE
+        self.dut.data_read_n.value = BUS_IDLE
+        await self.clk_falling_edge
+
+    async def _write(self, reg, value, width):
+        self.counters[f"write{BUS_WIDTH_BITS[width]}_reg{reg}"] += 1
+        self.dut.address.value = reg
+        self.dut.data_in.value = value & BUS_WIDTH_MASK[width]
+        self.dut.data_write_n.value = width
+        await self.clk_edge
+        await self._end_transaction()
+
+    # The read completes on the first rising edge with data_ready high,
+    # data_out is sampled just before that edge
+    async def _read(self, reg, width):
+        self.counters[f"read{BUS_WIDTH_BITS[width]}_reg{reg}"] += 1
+        self.dut.address.value = reg
+        self.dut.data_read_n.value = width
+        while True:
+            await ReadOnly()
+            data_ready = self.dut.data_ready.value == 1
+            value = int(self.dut.data_out.value) & BUS_WIDTH_MASK[width]
+            await self.clk_edge
+            if data_ready:
+                break
+        await self._end_transaction()
+        return value
+
+    # Write a value to a byte register in your design
+    # reg is the address of the register in the range 0-15
+    # value is the value to be written, in the range 0-255
+    async def write_byte_reg(self, reg, value):
+        await self._write(reg, value, BUS_WIDTH_BYTE)
+
+    # Read the value of a byte register from your design
+    # reg is the address of the register in the range 0-15
+    # The returned value is the data read from the register, in the range 0-255
+    async def read_byte_reg(self, reg):
+        return await self._read(reg, BUS_WIDTH_BYTE)
+
+    # Write a value to a half word register in your design
+    # reg is the address of the register in the range 0-15
+    # value is the value to be written, in the range 0-65535
+    async def write_hword_reg(self, reg, value):
+        await self._write(reg, value, BUS_WIDTH_HWORD)
+
+    # Read the value of a half word register from your design
+    # reg is the address of the register in the range 0-15
+    # The returned value is the data read from the register, in the range 0-65535
+    async def read_hword_reg(self, reg):
+        return await self._read(reg, BUS_WIDTH_HWORD)
+
+    # Write a value to a word register in your design
+    # reg is the address of the register in the range 0-15
+    # value is the value to be written
+    async def write_word_reg(self, reg, value):
+        await self._write(reg, value, BUS_WIDTH_WORD)
+
+    # Read the value of a word register from your design
+    # reg is the address of the register in the range 0-15
+    # The returned value is the data read from the register
+    async def read_word_reg(self, reg):
+        return await self._read(reg, BUS_WIDTH_WORD)
+
+    # Check whether the user interrupt is asserted
+    async def is_interrupt_asserted(self):
+        return self.dut.uio_out[0].value == 1
@@ -0,0 +1,349 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# Compiles a target waveform, given as (level, duration_ns) runs, into the register image and program
+# that take the fewest bits of PROGRAM_DATA_MEM while every run is within a timing tolerance.
+#
+# A symbol lasts (duration + 2) << prescaler cycles, as in _get_expected_from_symbol, so for a prescaler
+# the durations a run may have as a single symbol are an interval of ticks. Picking the durations of a level
+# is then stabbing those intervals with as few integer points as possible, which is done greedily by their
+# right ends instead of trying every combination of durations:
+#   2bpe: each level has 2 main durations, the first up to 8 runs may use the 2 auxillary durations instead,
+#         runs that do not fit in a single symbol are split into several, choosing from a few candidate durations
+#   1bpe: the runs are taken in pairs, and all pairs must be one of 2 templates, for a bit per pair
+# The result is checked against the reference model.
+
+from typing import NamedTuple
+
+import numpy as np
+
+import program_image
+import pulse_model
+from register_image import RegisterImage
+
+MIN_TICKS = 2 # duration + 2, the duration fields are 8 bits
+MAX_TICKS = 257
+MAX_PRESCALER = 15
+NUM_AUXILLARY = 8 # the elements covered by auxillary_mask
+MAX_SYMBOLS_2BPE = program_image.PROGRAM_BITS // 2
+MAX_CARRIER_DURATION = (1 << 11) - 1
+MAX_CANDIDATES = 32 # the durations tried when runs are split into several symbols
+
+class WaveformProgram(NamedTuple):
+    registers: RegisterImage # the indices, loop count and loop_forever are set for a single pass from index 0
+    words: list[int] # PROGRAM_DATA_MEM from word 0 on
+    elements: list[int] # the bits in 1bpe, the symbols (transmit_level << 1 | duration_selector) in 2bpe
+    max_error_ns: float # the largest difference between a run of the target and of the reference model
+
+    @property
+    def program_bits(self) -> int:
+        return len(self.elements) * (2 if self.registers.use_2bpe else 1)
+
+class _Level(NamedTuple):
+    ticks: tuple[int, int] # duration selector 0 and 1, duration + 2
+    counts: list[tuple[int, int]] # per run, the number of symbols of each duration
+
+def _stab(lo: np.ndarray, hi: np.ndarray, max_points: int) -> list[int] | None:
+    # The fewest integer points within [MIN_TICKS, MAX_TICKS] such that each [lo, hi] holds one,
+    # None if there are more than max_points
+    lo = np.maximum(np.ceil(lo), MIN_TICKS)
+    hi = np.minimum(np.floor(hi), MAX_TICKS)
+    if np.any(lo > hi):
+        return None
+    points = []
+    for index in np.argsort(hi, kind="stable").tolist():
+        # The points are increasing, and no more than hi
+        if points and lo[index] <= points[-1]:
+            continue
+        if len(points) == max_points:
+            return None
+        points.append(int(hi[index]))
+    return points
+
+def _assign(points: list[int], targets: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    # The nearest point each interval holds, or -1
+    points = np.array(points, dtype=np.float64)
+    inside = (points >= np.ceil(lo)[:, None]) & (points <= np.floor(hi)[:, None])
+    distance = np.where(inside, np.abs(points - targets[:, None]), np.inf)
+    return np.where(inside.any(axis=1), np.argmin(distance, axis=1), -1)
+
+def _refine(points: list[int], assignment: np.ndarray, targets: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> list[int]:
+    # Moves each point to its runs' mean, within all of their intervals, for the smallest errors
+    refined = []
+    for index, point in enumerate(points):
+        mine = assignment == index
+        if not mine.any():
+            refined.append(point)
+            continue
+        low = max(int(np.ceil(lo[mine]).max()), MIN_TICKS)
+        high = min(int(np.floor(hi[mine]).min()), MAX_TICKS)
+        refined.append(min(max(round(float(targets[mine].mean())), low), high))
+    return refined
+
+def _single_symbols(targets: np.ndarray, tolerances: np.ndarray, max_points: int = 2):
+    # One symbol per run, returns the points and the index of the point of each run
+    lo, hi = targets - tolerances, targets + tolerances
+    points = _stab(lo, hi, max_points)
+    if points is None:
+        return None
+    assignment = _assign(points, targets, lo, hi)
+    points = _refine(points, assignment, targets, lo, hi)
+    return points, _assign(points, targets, lo, hi)
+
+def _candidates(targets: np.ndarray, tolerances: np.ndarray) -> np.ndarray:
+    # Durations that split a run into the fewest equal symbols, and a few more, then the longest symbol
+    values = [MAX_TICKS]
+    for extra in range(4):
+        for target, tolerance in zip(targets.tolist(), tolerances.tolist()):
+            count = max(1, -(-(target - tolerance) // MAX_TICKS)) + extra
+            values += [int(np.floor(target / count)), int(np.ceil(target / count))]
+        values = list(dict.fromkeys(value for value in values if MIN_TICKS <= value <= MAX_TICKS))
+        if len(values) >= MAX_CANDIDATES:
+            break
+    return np.array(values[:MAX_CANDIDATES], dtype=np.float64)
+
+def _split_symbols(targets: np.ndarray, tolerances: np.ndarray, weights: np.ndarray, window: int = 8):
+    # Several symbols per run, of 2 durations a <= b: for each pair of candidates, the fewest symbols of a run
+    # are found by trying the most b that leave a remainder of a multiple of a, within a window
+    values = _candidates(targets, tolerances)
+    first, second = np.triu_indices(len(values))
+    a = values[first][:, None, None]
+    b = values[second][:, None, None]
+    target = targets[None, :, None]
+    tolerance = tolerances[None, :, None]
+
+    count_b = np.floor((target + tolerance) / b) - np.arange(window)[None, None, :]
+    count_a = np.maximum(np.round((target - count_b * b) / a), 0)
+    error = np.abs(count_a * a + count_b * b - target)
+    symbols = count_a + count_b
+    feasible = (count_b >= 0) & (error <= tolerance) & (symbols >= 1)
+    choice = np.argmax(feasible, axis=2)[..., None]
+    symbols = np.where(np.take_along_axis(feasible, choice, axis=2), np.take_along_axis(symbols, choice, axis=2), np.inf)[..., 0]
+
+    cost = symbols @ weights
+    pair = int(np.argmin(cost))
+    if not np.isfinite(cost[pair]):
+        return None
+    counts_a = np.take_along_axis(count_a, choice, axis=2)[pair, :, 0].astype(int)
+    counts_b = np.take_along_axis(count_b, choice, axis=2)[pair, :, 0].astype(int)
+    return int(cost[pair]), (int(values[first[pair]]), int(values[second[pair]])), list(zip(counts_a.tolist(), counts_b.tolist()))
+
+def _fit_level(targets: np.ndarray, tolerances: np.ndarray, max_symbols: int) -> tuple[int, _Level] | None:
+    # The 2 durations of a level, in ticks of a prescaler, and the symbols of each run,
+    # None if there are none that take at most max_symbols
+    if len(targets) == 0:
+        return 0, _Level((MIN_TICKS, MIN_TICKS), [])
+    # The tolerance only depends on the target
+    unique, first, inverse, weights = np.unique(targets, return_index=True, return_inverse=True, return_counts=True)
+    unique_tolerances = tolerances[first]
+
+    single = _single_symbols(unique, unique_tolerances)
+    if single is not None:
+        if len(targets) > max_symbols:
+            return None
+        points, assignment = single
+        points = points + points[-1:] * (2 - len(points))
+        counts = [(0, 1) if index else (1, 0) for index in assignment[inverse].tolist()]
+        return len(targets), _Level(tuple(points), counts)
+
+    # The stabbing is optimal, so splitting takes more than a symbol for some run
+    if len(targets) >= max_symbols:
+        return None
+    split = _split_symbols(unique, unique_tolerances, weights.astype(np.float64))
+    if split is None or split[0] > max_symbols:
+        return None
+    cost, ticks, counts = split
+    return cost, _Level(ticks, [counts[index] for index in inverse.tolist()])
+
+def _prescaled(cycles: np.ndarray, tolerances: np.ndarray, prescaler: int) -> tuple[np.ndarray, np.ndarray]:
+    scale = 1 << prescaler
+    return cycles / scale, tolerances / scale
+
+def _fit_auxillary(cycles: np.ndarray, tolerances: np.ndarray):
+    # A single auxillary symbol per run, with the finest prescaler they fit in
+    for prescaler in range(MAX_PRESCALER + 1):
+        single = _single_symbols(*_prescaled(cycles, tolerances, prescaler))
+        if single is not None:
+            points, assignment = single
+            return prescaler, points + points[-1:] * (2 - len(points)), assignment.tolist()
+    return None
+
+def _fit_main(levels: np.ndarray, cycles: np.ndarray, tolerances: np.ndarray, max_symbols: int):
+    # The prescaler and durations of both levels for the fewest symbols, the finest prescaler on a tie,
+    # None if they do not fit in max_symbols
+    best = None
+    for prescaler in range(MAX_PRESCALER + 1):
+        targets, prescaled_tolerances = _prescaled(cycles, tolerances, prescaler)
+        if len(targets) and np.floor((targets + prescaled_tolerances).min()) < MIN_TICKS:
+            # The shortest run is too short for this prescaler, and for the larger ones
+            break
+        # A run takes a symbol, or more if it is longer than a symbol can be. The symbols to spare
+        # over this are checked before fitting the durations of a level, the slow part
+        fewest = np.maximum(np.ceil((targets - prescaled_tolerances) / MAX_TICKS), 1)
+        spare = (max_symbols if best is None else min(max_symbols, best[0] - 1)) - int(fewest.sum())
+        if spare < 0:
+            continue
+        total = 0
+        fits = []
+        for level in (0, 1):
+            mine = levels == level
+            level_fewest = int(fewest[mine].sum())
+            fit = _fit_level(targets[mine], prescaled_tolerances[mine], level_fewest + spare)
+            if fit is None:
+                break
+            spare -= fit[0] - level_fewest
+            total += fit[0]
+            fits.append(fit[1])
+        else:
+            best = (total, prescaler, fits)
+            if total == len(targets):
+                break
+    return best
+
+def _compile_2bpe(levels: np.ndarray, cycles: np.ndarray, tolerances: np.ndarray):
+    # Hands the first runs to the auxillary durations, as many as lowers the number of symbols
+    if len(cycles) > MAX_SYMBOLS_2BPE:
+        # Each run takes a symbol at least
+        return None
+    best = None
+    for num_auxillary in range(min(NUM_AUXILLARY, len(cycles)) + 1):
+        auxillary = _fit_auxillary(cycles[:num_auxillary], tolerances[:num_auxillary]) if num_auxillary else (0, [MIN_TICKS] * 2, [])
+        if auxillary is None:
+            # More runs will not fit either
+            break
+        rest = slice(num_auxillary, None)
+        max_symbols = (MAX_SYMBOLS_2BPE if best is None else best[0] - 1) - num_auxillary
+        main = _fit_main(levels[rest], cycles[rest], tolerances[rest], max_symbols)
+        if main is None:
+            continue
+        total = num_auxillary + main[0]
+        best = (total, num_auxillary, auxillary, main)
+        if total == len(cycles):
+            break
+    if best is None:
+        return None
+
+    _, num_auxillary, (auxillary_prescaler, auxillary_ticks, auxillary_selectors), (_, main_prescaler, fits) = best
+    symbols = [int(level) << 1 | selector for level, selector in zip(levels[:num_auxillary].tolist(), auxillary_selectors)]
+    positions = [0, 0]
+    for level in levels[num_auxillary:].tolist():
+        count_a, count_b = fits[level].counts[positions[level]]
+        positions[level] += 1
+        symbols += [level << 1 | 1] * count_b + [level << 1] * count_a
+
+    registers = RegisterImage(
+        use_2bpe=1,
+        main_low_duration_a=fits[0].ticks[0] - 2,
+        main_low_duration_b=fits[0].ticks[1] - 2,
+        main_high_duration_a=fits[1].ticks[0] - 2,
+        main_high_duration_b=fits[1].ticks[1] - 2,
+        auxillary_mask=(1 << num_auxillary) - 1,
+        auxillary_duration_a=auxillary_ticks[0] - 2,
+        auxillary_duration_b=auxillary_ticks[1] - 2,
+        auxillary_prescaler=auxillary_prescaler,
+        main_prescaler=main_prescaler,
+        program_end_index=(len(symbols) - 1) * 2,
+    )
+    return registers, program_image.pack_2bpe(symbols).tolist(), symbols
+
+def _compile_1bpe(levels: np.ndarray, cycles: np.ndarray, tolerances: np.ndarray):
+    # A pair of runs per bit, the first and the second runs of the pairs each take 2 durations of their level,
+    # and the pairs may use 2 of the 4 combinations of them
+    if len(cycles) % 2 or len(cycles) // 2 > program_image.PROGRAM_BITS:
+        return None
+    for prescaler in range(MAX_PRESCALER + 1):
+        targets, prescaled_tolerances = _prescaled(cycles, tolerances, prescaler)
+        fits = [_single_symbols(targets[half::2], prescaled_tolerances[half::2]) for half in (0, 1)]
+        if None in fits:
+            continue
+
+        # The durations each pair may take, then the 2 combinations that cover all pairs
+        options = []
+        for half, (points, _) in enumerate(fits):
+            lo = targets[half::2] - prescaled_tolerances[half::2]
+            hi = targets[half::2] + prescaled_tolerances[half::2]
+            options.append([(np.ceil(lo) <= point) & (point <= np.floor(hi)) for point in points] + [np.zeros(len(lo), dtype=bool)] * (2 - len(points)))
+        combinations = [(first, second) for first in (0, 1) for second in (0, 1)]
+        allowed = [options[0][first] & options[1][second] for first, second in combinations]
+        for zero in range(4):
+            for one in range(zero, 4):
+                if not np.all(allowed[zero] | allowed[one]):
+                    continue
+                bits = np.where(allowed[zero], 0, 1)
+                (first_points, _), (second_points, _) = fits
+                first_points = first_points + first_points[-1:] * (2 - len(first_points))
+                second_points = second_points + second_points[-1:] * (2 - len(second_points))
+                first_level, second_level = int(levels[0]), int(levels[1])
+                ticks = [[MIN_TICKS, MIN_TICKS], [MIN_TICKS, MIN_TICKS]]
+                ticks[first_level] = first_points
+                ticks[second_level] = second_points
+                lut = [level << 1 | selector for combination in (combinations[zero], combinations[one])
+                    for level, selector in zip((first_level, second_level), combination)]
+                registers = RegisterImage(
+                    low_symbol_0=lut[0],
+                    low_symbol_1=lut[1],
+                    high_symbol_0=lut[2],
+                    high_symbol_1=lut[3],
+                    main_low_duration_a=ticks[0][0] - 2,
+                    main_low_duration_b=ticks[0][1] - 2,
+                    main_high_duration_a=ticks[1][0] - 2,
+                    main_high_duration_b=ticks[1][1] - 2,
+                    main_prescaler=prescaler,
+                    program_end_index=len(bits) - 1,
+                )
+                return registers, program_image.pack_1bpe(bits).tolist(), bits.tolist()
+    return None
+
+def model_runs(registers: RegisterImage, words: list[int]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The transmit level and duration in cycles of each run, as pulse_model simulates the program.
+    """
+    # The carrier does not change the symbols, the longest period saves simulating a run per carrier edge
+    registers = registers.copy()
+    registers.carrier_duration = MAX_CARRIER_DURATION
+    schedule = pulse_model.simulate(registers.to_registers(), words)
+    durations, levels = pulse_model.merge_runs(schedule.symbol_durations, schedule.symbol_levels)
+    return levels, durations
+
+def compile_waveform(waveform, clock_hz: int = 64_000_000, tolerance: float = 0.05) -> WaveformProgram:
+    """
+    Compile a waveform into the program that takes the fewest bits of PROGRAM_DATA_MEM.
+
+    Args:
+        waveform: The (level, duration_ns) of each run, as a list or a N x 2 array.
+            Consecutive runs of the same level are merged
+        clock_hz (int): The clock frequency of the peripheral
+        tolerance (float): The relative error allowed on the duration of each run,
+            or half a clock cycle if more
+
+    Returns:
+        WaveformProgram: The register image and program, start it with start_program
+    """
+    waveform = np.asarray(waveform, dtype=np.float64).reshape(-1, 2)
+    if len(waveform) == 0:
+        raise ValueError("The waveform must have at least one run")
+    if np.any((waveform[:, 0] != 0) & (waveform[:, 0] != 1)):
+        raise ValueError("The levels of the waveform must be 0 or 1")
+    if np.any(waveform[:, 1] <= 0):
+        raise ValueError("The durations of the waveform must be positive")
+    if not 0 <= tolerance < 1:
+        raise ValueError(f"tolerance must be in the range 0 to 1, not {tolerance}")
+
+    levels = waveform[:, 0].astype(np.uint8)
+    starts = np.flatnonzero(np.concatenate(([True], levels[1:] != levels[:-1])))
+    durations_ns = np.add.reduceat(waveform[:, 1], starts)
+    levels = levels[starts]
+    cycles = durations_ns * clock_hz / 1e9
+    tolerances = np.maximum(cycles * tolerance, 0.5)
+
+    # 1bpe takes a bit per pair of runs, 2bpe 2 bits per symbol
+    compiled = _compile_1bpe(levels, cycles, tolerances) or _compile_2bpe(levels, cycles, tolerances)
+    if compiled is None:
+        raise ValueError(f"The waveform of {len(levels)} runs does not fit in PROGRAM_DATA_MEM within a tolerance of {tolerance}")
+    registers, words, elements = compiled
+
+    model_levels, model_cycles = model_runs(registers, words)
+    assert model_levels.tolist() == levels.tolist(), "The program does not have the runs of the waveform"
+    errors = np.abs(model_cycles - cycles)
+    assert np.all(errors <= tolerances), "The program is not within the tolerance of the waveform"
+    return WaveformProgram(registers, words, elements, float(errors.max() * 1e9 / clock_hz))
@@ -0,0 +1,115 @@
+# SPDX-FileCopyrightText: © 2025 HX2003
+# SPDX-License-Identifier: Apache-2.0
+
+# WS2812B addressable LEDs: RGB frames as (N, 3) uint8 NumPy arrays to pages of a 1bpe program,
+# with the channel order, an optional gamma and brightness LUT and the bit expansion vectorized.
+#
+# The bits are sent MSB first, and the program counts up from 0, so each byte is bit reversed
+# on the way into PROGRAM_DATA_MEM. The reversal and the LUT are combined into a single table,
+# a frame is then encoded with one gather and a copy.
+
+from typing import NamedTuple
+
+import numpy as np
+
+import program_image
+from register_image import RegisterImage
+
+PAGE_BITS = program_image.PROGRAM_BITS
+PAGE_WORDS = program_image.NUM_PROGRAM_WORDS
+PAGE_BYTES = PAGE_BITS // 8
+
+class Timing(NamedTuple):
+    # The high and low times of a 0 and of a 1, in ns
+    t0h: float
+    t0l: float
+    t1h: float
+    t1l: float
+
+WS2812B_TIMING = Timing(400, 850, 800, 450)
+
+_BYTES = np.arange(256, dtype=np.uint8)
+_REVERSED = np.unpackbits(_BYTES[:, None], axis=1, bitorder="little")
+_REVERSED = np.packbits(_REVERSED, axis=1, bitorder="big")[:, 0]
+
+def timing_registers(clock_hz: int, timing: Timing = WS2812B_TIMING) -> RegisterImage:
+    """
+    The symbol LUT and durations of a 1bpe WS2812B program, without prescaler.
+    The indices are left to the caller, see Ws2812Frame.page_end_index.
+
+    Args:
+        clock_hz (int): The clock frequency of the peripheral
+        timing (Timing): The bit timing of the LEDs
+
+    Returns:
+        RegisterImage: The register image
+    """
+    def duration(ns: float) -> int:
+        value = round(ns * clock_hz / 1e9) - 2
+        if not 0 <= value <= 255:
+            raise ValueError(f"{ns} ns can not be set without a prescaler at {clock_hz} Hz")
+        return value
+
+    # A 0 is high_a then low_a, a 1 is high_b then low_b
+    return RegisterImage(
+        low_symbol_0=0b10,
+        low_symbol_1=0b00,
+        high_symbol_0=0b11,
+        high_symbol_1=0b01,
+        main_low_duration_a=duration(timing.t0l),
+        main_low_duration_b=duration(timing.t1l),
+        main_high_duration_a=duration(timing.t0h),
+        main_high_duration_b=duration(timing.t1h),
+    )
+
+def gamma_lut(gamma: float = 2.8, brightness: float = 1.0) -> np.ndarray:
+    """
+    A LUT of 256 uint8 values, for the lut argument of encode_frame.
+
+    Args:
+        gamma (float): The gamma correction, 1.0 for none
+        brightness (float): Scales the output, 0.0 to 1.0
+    """
+    if not 0.0 <= brightness <= 1.0:
+        raise ValueError(f"brightness must be in the range 0.0 to 1.0, not {brightness}")
+    return np.round((_BYTES / 255.0) ** gamma * brightness * 255).astype(np.uint8)
+
+class Ws2812Frame(NamedTuple):
+    pages: np.ndarray # (pages, PAGE_WORDS) uint32, each page a full PROGRAM_DATA_MEM image, the last one padded with 0
+    num_bits: int
+
+    # program_end_index of a page, for a program starting at 0
+    def page_end_index(self, page: int) -> int:
+        return min(PAGE_BITS, self.num_bits - page * PAGE_BITS) - 1
+
+    # The bits in the order they are transmitted, e.g. for ProgramStream
+    def bits(self) -> np.ndarray:
+        return np.unpackbits(self.pages.view(np.uint8), bitorder="little")[:self.num_bits]
+
+def encode_frame(pixels: np.ndarray, lut: np.ndarray = None, order: str = "GRB") -> Ws2812Frame:
+    """
+    Encode a frame of pixels into program pages.
+
+    Args:
+        pixels (np.ndarray): (N, 3) uint8, the R, G and B value of each pixel, in the order of the strip
+        lut (np.ndarray): Maps each channel value, e.g. gamma_lut(), None for none
+        order (str): The order in which the LEDs expect the channels
+
+    Returns:
+        Ws2812Frame: The pages and the number of bits
+    """
+    pixels = np.asarray(pixels)
+    if pixels.ndim != 2 or pixels.shape[1] != 3 or pixels.dtype != np.uint8:
+        raise ValueError(f"pixels must be a (N, 3) uint8 array, not {pixels.shape} {pixels.dtype}")
+    if sorted(order) != sorted("RGB"):
+        raise ValueError(f"order must be a permutation of RGB, not {order}")
+
+    table = _REVERSED if lut is None else _REVERSED[lut]
+    num_bytes = pixels.size
+    num_pages = -(-num_bytes // PAGE_BYTES)
+    data = np.zeros(num_pages * PAGE_BYTES, dtype=np.uint8)
+    channels = pixels[:, ["RGB".index(channel) for channel in order]]
+    np.take(table, channels.reshape(-1), out=data[:num_bytes])
+
+    # Bit n of a page is bit n % 32 of word n // 32
+    return Ws2812Frame(data.view("<u4").astype(np.uint32, copy=False).reshape(num_pages, PAGE_WORDS), num_bytes * 8)